@@ -6,14 +6,23 @@
 Module to assign secondary FEDEFL contexts, including release height
 and population density (urban/rural).
 """
+import hashlib
 import logging as log
+import os
 import urllib.error
+from functools import lru_cache
 from pathlib import Path
+from urllib.parse import urlparse
 
 import numpy as np
 import pandas as pd
+import requests
 import yaml
 
+from esupy.processed_data_mgmt import Paths
+from esupy.remote import cached_file, check_urls
+from esupy.util import FileLock
+
 try:
     import geopandas as gpd
     import shapely as sh
@@ -71,46 +80,101 @@ def urb_intersect(df_pt, year):
     df_pt = pd.DataFrame(gdf_pt.drop(columns=['geometry','urban']))
     return df_pt
 
-def get_census_shp(year, urls=shp_urls):
+def get_census_shp(year, urls=shp_urls, paths=None):
     """
-    Read in shapefile as gpd geodataframe. Refer to esupy/data_census/README.md
-    for explanation gpd.read_file() encoding errors for pre-2015 SHPs.
+    Read in the Census urban area polygons of a data year as a WGS84 gpd
+    geodataframe. The harmonized polygons are cached as GeoParquet in the
+    local data store, keyed by the source shapefile URLs, so that later calls
+    and data years sharing shapefiles (2010, 2011) read the cache instead of
+    downloading and parsing the shapefiles again. Refer to
+    esupy/data_census/README.md for explanation gpd.read_file() encoding
+    errors for pre-2015 SHPs.
     :param year: int, data year
     :param urls: pathlib.Path, filepath of YAML containing shapefile URLs
-    :param filename: file name string with extension
-    """
-    with urls.open() as f:
-        uac_url = yaml.safe_load(f)
-    try:
-        log.info(f'Retrieving {year} UAC shapefile from URL:\n{uac_url[year]}')
-        if year < 2015:
-            log.info('Before 2015, expect series of GeoPandas WARNINGs that '
-                     'utf-8 codec fails for certain strings.\n See Text Encoding '
-                     'section of esupy/data_census/README.md for explanation.')
-        if year in [2010, 2011]:  # data years rely on 2x SHP's
-            gdf0 = gpd.read_file(uac_url[year][0])
-            gdf1 = gpd.read_file(uac_url[year][1])
-            gdf = gdf0.append(gdf1)
-            if not gdf.crs == gdf0.crs == gdf1.crs:
-                log.error(f'Combined {year} gdf CRS is inconsistent')
-        else:
-            gdf = gpd.read_file(uac_url[year])
-            # gdf = gpd.read_file(uac_url[year], encoding='iso-8859-1')
-            # BUG: should accept 'encoding' kwarg but returns error as of 04/15/22
-    except KeyError:
+    :param paths: instance of class Paths, defaults to Paths()
+    :return: gpd.GeoDataFrame, None if the data year is unavailable
+    """
+    uac_url = read_shp_urls(urls)
+    if year not in uac_url:
         log.error(f'Census urban area data year {year} unavailable')
-    except urllib.error.HTTPError:
-        log.error('File unavailable, check Census domain status:\n' +
-                  uac_url[year])
         return None
+    sources = uac_url[year]  # data years 2010, 2011 rely on 2x SHP's
+    if not isinstance(sources, list):
+        sources = [sources]
+    cache = census_shp_cache_path(sources, paths)
+    if cache.exists():
+        log.info(f'Loading {year} UAC polygons from {cache}')
+        return gpd.read_parquet(cache)
+    with FileLock(cache) as lock:
+        if lock.waited and cache.exists():
+            return gpd.read_parquet(cache)
+        try:
+            log.info(f'Retrieving {year} UAC shapefile from URL:\n' +
+                     '\n'.join(sources))
+            if year < 2015:
+                log.info('Before 2015, expect series of GeoPandas WARNINGs '
+                         'that utf-8 codec fails for certain strings.\n See '
+                         'Text Encoding section of esupy/data_census/'
+                         'README.md for explanation.')
+            # convert to WGS84 before combining
+            gdf = pd.concat([crs_harmonize(gpd.read_file(cached_file(u)))
+                             for u in sources], ignore_index=True)
+            # gdf = gpd.read_file(uac_url[year], encoding='iso-8859-1')
+            # BUG: should accept 'encoding' kwarg but returns error as of 04/15/22
+        except (urllib.error.HTTPError, requests.exceptions.HTTPError):
+            log.error('File unavailable, check Census domain status:\n' +
+                      '\n'.join(sources))
+            return None
+
+        # check for empty/na geom values
+        ena = sum(gdf['geometry'].is_empty | gdf['geometry'].isna())
+        if ena > 0:
+            log.info(f"{year} Census SHP has {ena} empty + NA geometries")
+        tmp = cache.with_name(f'.{cache.name}.part')
+        gdf.to_parquet(tmp)
+        os.replace(tmp, cache)
+    return gdf
 
-    gdf = crs_harmonize(gdf)  # convert to WGS84
+def census_shp_cache_path(sources, paths=None):
+    """
+    Returns the local path of the cached urban area polygons combined from
+    the shapefile URLs in sources
+    :param sources: list of shapefile URLs
+    :param paths: instance of class Paths, defaults to Paths()
+    :return: pathlib.Path
+    """
+    paths = paths or Paths()
+    digest = hashlib.sha256('\n'.join(sources).encode()).hexdigest()[:12]
+    stem = Path(urlparse(sources[0]).path).stem
+    return paths.local_path / 'census_uac' / f'{stem}_{digest}.parquet'
 
-    # check for empty/na geom values
-    ena = sum(gdf['geometry'].is_empty | gdf['geometry'].isna())
-    if ena > 0:
-        log.info(f"{year} Census SHP has {ena} empty + NA geometries")
-    return gdf
+def read_shp_urls(urls=shp_urls):
+    """
+    Returns the dict of data-year: URL(s) in the YAML of shapefile URLs,
+    read once per change of the file
+    :param urls: pathlib.Path, filepath of YAML containing shapefile URLs
+    """
+    return _load_yaml(str(urls), urls.stat().st_mtime_ns)
+
+@lru_cache(maxsize=None)
+def _load_yaml(path, mtime_ns):
+    with open(path) as f:
+        return yaml.safe_load(f)
+
+def check_census_shp_urls(urls=shp_urls, **kwargs):
+    """
+    Checks that every shapefile URL in the YAML is reachable, without
+    downloading the files
+    :param urls: pathlib.Path, filepath of YAML containing shapefile URLs
+    :param kwargs: pass-through to esupy.remote.check_urls()
+    :return: pd.DataFrame of check_urls() results with a 'year' column
+    """
+    uac_url = read_shp_urls(urls)
+    pairs = [(year, u) for year, url in uac_url.items()
+             for u in (url if isinstance(url, list) else [url])]
+    df = check_urls([u for _, u in pairs], **kwargs)
+    df.insert(0, 'year', [year for year, _ in pairs])
+    return df
 
 def parse_pt_data(df):
     """
@@ -0,0 +1,217 @@
+# http_cache.py (esupy)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+On-disk cache of http responses, so that reference data fetched from the web
+is downloaded once and reused across runs
+"""
+import hashlib
+import json
+import logging as log
+import os
+import tempfile
+import time
+from pathlib import Path, PurePosixPath
+from urllib.parse import urlparse
+
+import appdirs
+import requests
+
+# response headers kept with a cached body
+KEPT_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+
+class ResponseCache:
+    """
+    Content-addressed store of response bodies. Each cached URL has an entry
+    entries/{sha256 of url}.json naming the SHA-256 digest of its body,
+    stored once in objects/ however many URLs return it. Entries are touched
+    on use; when the bodies outgrow max_bytes, the least recently used
+    entries and the bodies no longer referenced are removed. In offline
+    mode, cached entries are used whatever their age and uncached URLs fail
+    without contacting the network.
+    """
+    def __init__(self, root=None, max_bytes=5 * 1024 ** 3, offline=False):
+        """
+        :param root: pathlib.Path, cache folder; defaults to .http_cache in
+            the local data store
+        :param max_bytes: int, cap on the total size of cached bodies
+        :param offline: bool, only answer from the cache
+        """
+        self.root = (Path(root) if root is not None
+                     else Path(appdirs.user_data_dir()) / '.http_cache')
+        self.max_bytes = max_bytes
+        self.offline = offline
+
+    def entry(self, url):
+        """
+        :return: dict describing the cached response of url, None if missing
+        """
+        try:
+            entry = json.loads(self._entry_path(url).read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+        if not self.blob(entry).exists():
+            return None
+        return entry
+
+    @staticmethod
+    def is_fresh(entry, max_age=None):
+        """
+        :param entry: dict, as returned by entry()
+        :param max_age: float, seconds a response may be reused without
+            revalidating; None to reuse it until evicted
+        """
+        return max_age is None or time.time() - entry['stored'] < max_age
+
+    def blob(self, entry):
+        """:return: pathlib.Path of the cached body of entry"""
+        digest = entry['digest']
+        return self.root / 'objects' / digest[:2] / (digest + entry['suffix'])
+
+    def response(self, entry):
+        """
+        Builds a requests.Response from entry and marks entry as used
+        :return: requests.Response with status_code 200
+        """
+        r = requests.Response()
+        r.status_code = 200
+        r.url = entry['url']
+        r.headers.update(entry['headers'])
+        r.encoding = requests.utils.get_encoding_from_headers(r.headers)
+        r._content = self.blob(entry).read_bytes()
+        self.touch(entry)
+        return r
+
+    def store(self, url, response, chunk_size=1024 * 1024):
+        """
+        Streams the body of response into the cache as the entry of url
+        :param url: str, full URL including query string
+        :param response: requests.Response, ideally requested with
+            stream=True
+        :return: dict, the new entry
+        """
+        objects = self.root / 'objects'
+        objects.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=objects, suffix='.part')
+        sha = hashlib.sha256()
+        try:
+            with response, os.fdopen(fd, 'wb') as fi:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    fi.write(chunk)
+                    sha.update(chunk)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        return self._add(url, Path(tmp), sha.hexdigest(), response.headers)
+
+    def store_file(self, url, file, headers, chunk_size=1024 * 1024):
+        """
+        Moves a body already downloaded to file into the cache as the entry
+        of url
+        :param url: str, full URL including query string
+        :param file: pathlib.Path, on the same file system as the cache
+        :param headers: dict-like of the response headers
+        :return: dict, the new entry
+        """
+        sha = hashlib.sha256()
+        with open(file, 'rb') as fi:
+            for chunk in iter(lambda: fi.read(chunk_size), b''):
+                sha.update(chunk)
+        return self._add(url, Path(file), sha.hexdigest(), headers)
+
+    def _add(self, url, file, digest, headers):
+        """Moves file into objects/ as the body of a new entry of url"""
+        entry = {'url': url, 'digest': digest,
+                 'suffix': PurePosixPath(urlparse(url).path).suffix,
+                 'size': file.stat().st_size,
+                 'headers': {k: headers[k] for k in KEPT_HEADERS
+                             if k in headers}}
+        blob = self.blob(entry)
+        try:
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(file, blob)
+        except BaseException:
+            file.unlink(missing_ok=True)
+            raise
+        entry = self._write_entry(entry)
+        self.evict()
+        return entry
+
+    def refresh(self, entry):
+        """Restarts the age of entry after the server confirmed it is current"""
+        return self._write_entry(entry)
+
+    def touch(self, entry):
+        """Marks entry as recently used"""
+        try:
+            os.utime(self._entry_path(entry['url']))
+        except FileNotFoundError:
+            pass
+
+    def size(self):
+        """:return: int, total bytes of cached bodies"""
+        return sum(f.stat().st_size
+                   for f in (self.root / 'objects').glob('*/*'))
+
+    def evict(self, max_bytes=None):
+        """
+        Removes bodies no entry refers to anymore, then least recently used
+        entries and their bodies until cached bodies fit in max_bytes
+        :param max_bytes: int, defaults to self.max_bytes
+        :return: int, number of entries removed
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        if self.size() <= max_bytes:
+            return 0
+        entries = []
+        for p in (self.root / 'entries').glob('*.json'):
+            try:
+                entries.append((p.stat().st_mtime, p,
+                                json.loads(p.read_text())))
+            except (FileNotFoundError, ValueError):
+                continue
+        entries.sort(key=lambda e: e[0])
+        blobs = {}
+        for _, p, entry in entries:
+            blobs.setdefault(self.blob(entry), []).append(p)
+        for blob in (self.root / 'objects').glob('*/*'):
+            try:
+                # spare bodies another process is about to write an entry for
+                if (blob not in blobs
+                        and time.time() - blob.stat().st_mtime > 60):
+                    blob.unlink()
+            except FileNotFoundError:
+                pass
+        total = self.size()
+        removed = 0
+        for _, p, entry in entries:
+            if total <= max_bytes:
+                break
+            p.unlink(missing_ok=True)
+            removed += 1
+            blob = self.blob(entry)
+            blobs[blob].remove(p)
+            if not blobs[blob] and blob.exists():
+                total -= blob.stat().st_size
+                blob.unlink()
+        log.debug(f'Evicted {removed} responses from {self.root}')
+        return removed
+
+    def clear(self):
+        """Removes all cached responses"""
+        self.evict(max_bytes=-1)
+
+    def _entry_path(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return self.root / 'entries' / f'{key}.json'
+
+    def _write_entry(self, entry):
+        entry = {**entry, 'stored': time.time()}
+        path = self._entry_path(entry['url'])
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.part')
+        with os.fdopen(fd, 'w') as fi:
+            json.dump(entry, fi)
+        os.replace(tmp, path)
+        return entry
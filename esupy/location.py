@@ -6,6 +6,7 @@ Functions to facilitate creation of location objects
 """
 
 import bz2
+import io
 import json
 import pandas as pd
 from pathlib import Path
@@ -36,7 +37,8 @@ def extract_coordinates(group) -> dict:
         file = [file]
     features = []
     for f in file:
-        response = make_url_request(f'{url}/{f}')
+        response = make_url_request(f'{url}/{f}', cache=True,
+                                    max_age=7 * 24 * 60 * 60)
         content = bz2.decompress(response.content)
         data = json.loads(content)
         # extract GeoJSON objects from the FeatureCollection
@@ -57,7 +59,9 @@ def extract_coordinates(group) -> dict:
 def olca_location_meta():
     location_meta = ('https://raw.githubusercontent.com/GreenDelta/'
                      'data/master/refdata/locations.csv')
-    df = pd.read_csv(location_meta)
+    response = make_url_request(location_meta, cache=True,
+                                max_age=7 * 24 * 60 * 60)
+    df = pd.read_csv(io.StringIO(response.text))
     return df
 
 
@@ -108,8 +108,8 @@ def apply_flow_mapping(df, source, flow_type, keep_unmapped_rows=False,
     del_list = []
     for i in range(len(map_to)):
         if map_to[i] is not None:
-            df[map_to[i]].fillna('', inplace=True)
-            mapping[map_from[i]].fillna('', inplace=True)
+            df[map_to[i]] = fill_blank(df[map_to[i]])
+            mapping[map_from[i]] = mapping[map_from[i]].fillna('')
         else:
             del_list.append(i)
     del_list.reverse()
@@ -132,6 +132,12 @@ def apply_flow_mapping(df, source, flow_type, keep_unmapped_rows=False,
 
     for k, v in replacement_dict.items():
         try:
+            col = mapped_df[field_dict[k]]
+            if isinstance(col.dtype, pd.CategoricalDtype):
+                # categoricals only accept values among their categories
+                new = mapped_df.loc[criteria, v].dropna().unique()
+                mapped_df[field_dict[k]] = col.cat.add_categories(
+                    [x for x in new if x not in col.cat.categories])
             mapped_df.loc[criteria, field_dict[k]] = mapped_df[v]
         except KeyError:
             pass # Not mapping on that field
@@ -142,3 +148,16 @@ def apply_flow_mapping(df, source, flow_type, keep_unmapped_rows=False,
     mapped_df = mapped_df.drop(columns=mapping_fields)
 
     return mapped_df
+
+
+def fill_blank(s):
+    """
+    Fills missing values of s with '', including for categoricals (e.g. as
+    loaded with compact=True) that lack a '' category
+    :param s: pandas series
+    :return: pandas series
+    """
+    if isinstance(s.dtype, pd.CategoricalDtype) and \
+            '' not in s.cat.categories:
+        s = s.cat.add_categories([''])
+    return s.fillna('')
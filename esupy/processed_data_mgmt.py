@@ -5,26 +5,164 @@
 Functions to manage querying, retrieving and storing of preprocessed data in
 local directories
 """
+import hashlib
 import json
 import logging as log
 import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
+from email.utils import formatdate, parsedate_to_datetime
 from pathlib import Path
 
 import appdirs
-import boto3
+import numpy as np
 import pandas as pd
-from botocore.handlers import disable_signing
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from pyarrow.fs import LocalFileSystem
 
-from esupy.remote import make_url_request
-from esupy.util import strip_file_extension
+from esupy.remote import response_validators
+from esupy.storage import get_backend
+from esupy.util import FileLock
+
+
+# {name}_v{version}_{git_hash}_{suffix}.{ext}, all but name and ext optional
+FILE_NAME_PATTERN = re.compile(
+    r'^(?P<name>.+?)'
+    r'(?:_v(?P<version>\d+(?:\.\d+)*[^_.]*)'
+    r'(?:_(?P<git_hash>[0-9a-f]{7}))?'
+    r'(?:_(?P<suffix>[^.]+))?)?'
+    r'\.(?P<ext>[^._]+(?:\.(?:gz|zst))?)$')
+
+# parquet schema metadata key listing the partition columns of a dataset
+PARTITION_KEY = b'esupy_partition_cols'
+
+# parquet schema metadata key identifying the .rds source of a transcode
+RDS_SOURCE_KEY = b'esupy_rds_source'
+
+# file name suffix of csv output for each supported compression
+CSV_COMPRESSION = {'gzip': '.gz', 'zstd': '.zst'}
+
+# hidden manifest of remote validators kept in each local data folder
+VALIDATORS_FILE = '.remote_validators.json'
 
 
 class Paths:
     def __init__(self):
         self.local_path = Path(appdirs.user_data_dir())
         self.remote_path = 'https://dmap-data-commons-ord.s3.amazonaws.com/'
+        # seconds a locally cached data commons index is considered current
+        self.index_ttl = 24 * 60 * 60
+        # storage backend instance overriding the one chosen by remote_path,
+        # see esupy.storage.get_backend(); its repr identifies the cached
+        # index, so it must be stable across runs
+        self.backend = None
     # TODO: rename as DataPaths {.local, .remote}
 
+class DataFrameCache:
+    """
+    In-process LRU cache of dataframes read by read_into_df(), held within a
+    byte budget. Entries are keyed on the resolved file path, its mtime and
+    size, and the columns/filters requested, so a changed file is never
+    served from cache. Copies are returned so callers can not alter cached
+    frames. Disabled while max_bytes is 0; see enable_df_cache().
+    """
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @staticmethod
+    def make_key(fpath, columns=None, filters=None, *options):
+        fpath = Path(fpath).resolve()
+        st = fpath.stat()
+        return (str(fpath), st.st_mtime_ns, st.st_size,
+                None if columns is None else tuple(columns), repr(filters),
+                *options)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._frames.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._frames.move_to_end(key)
+            self.hits += 1
+        return entry[0].copy()
+
+    def put(self, key, df):
+        nbytes = int(df.memory_usage(deep=True, index=True).sum())
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._frames:
+                self.nbytes -= self._frames.pop(key)[1]
+            self._frames[key] = (df.copy(), nbytes)
+            self.nbytes += nbytes
+            self._evict(self.max_bytes)
+
+    def invalidate(self, fpath):
+        """Drops all cached frames read from fpath"""
+        path = str(Path(fpath).resolve())
+        with self._lock:
+            for key in [k for k in self._frames if k[0] == path]:
+                self.nbytes -= self._frames.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """
+        :return: dict of hits, misses, evictions, entries, nbytes, max_bytes
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self._frames), 'nbytes': self.nbytes,
+                    'max_bytes': self.max_bytes}
+
+    def _evict(self, budget):
+        while self.nbytes > budget and self._frames:
+            self.nbytes -= self._frames.popitem(last=False)[1][1]
+            self.evictions += 1
+
+
+df_cache = DataFrameCache()
+
+
+def enable_df_cache(max_bytes=2 * 1024 ** 3):
+    """
+    Turns on in-process caching of dataframes read by read_into_df(), and
+    so load_preprocessed_output(), evicting least recently used frames
+    beyond max_bytes. Pass max_bytes=0 to turn caching off again.
+    :param max_bytes: int, memory budget in bytes
+    :return: DataFrameCache, the module cache
+    """
+    with df_cache._lock:
+        df_cache.max_bytes = max_bytes
+        df_cache._evict(max_bytes)
+    return df_cache
+
+
 class FileMeta:
     def __init__(self):
         self.tool = ""
@@ -35,214 +173,1469 @@ class FileMeta:
         self.ext = ""
         self.date_created = ""
         self.tool_meta = ""
+        # column dtypes of csv output, set by write_df_to_file
+        self.schema = None
 
 
-def load_preprocessed_output(file_meta, paths):
+def load_preprocessed_output(file_meta, paths, columns=None, filters=None,
+                             compact=False):
     """
     Loads a preprocessed file
     :param file_meta: populated instance of class FileMeta
     :param paths: instance of class Paths
+    :param columns: list of column names to load, default all
+    :param filters: row filters pushed down to the reader, see read_into_df()
+    :param compact: bool, return low-cardinality strings as categoricals
+        and downcast numbers, see compact_df()
     :return: a pandas dataframe of the datafile if exists or None if it
         doesn't exist
     """
     f = find_file(file_meta, paths)
     if isinstance(f, Path):
         log.info(f'Returning {f}')
-        df = read_into_df(f)
+        df = read_into_df(f, columns=columns, filters=filters,
+                          compact=compact)
         return df
     else:
         return None
 
 
-def download_from_remote(file_meta, paths, **kwargs):
+def iter_preprocessed_output(file_meta, paths, chunksize=100_000,
+                             columns=None, filters=None):
+    """
+    Loads a preprocessed file incrementally, yielding dataframes of at most
+    chunksize rows so that files larger than memory can be processed
+    :param file_meta: populated instance of class FileMeta
+    :param paths: instance of class Paths
+    :param chunksize: int, max rows per chunk
+    :param columns: list of column names to load, default all
+    :param filters: row filters, see read_into_df()
+    :return: generator of pandas dataframes; yields nothing if the file
+        doesn't exist
+    """
+    f = find_file(file_meta, paths)
+    if isinstance(f, Path):
+        log.info(f'Returning {f} in chunks of {chunksize} rows')
+        yield from iter_file_chunks(f, chunksize=chunksize, columns=columns,
+                                    filters=filters)
+
+
+def iter_file_chunks(fpath, chunksize=100_000, columns=None, filters=None):
+    """
+    Based on a file extension, reads a file as a sequence of dataframes:
+    record batches for parquet (files or partitioned datasets) and arrow,
+    and chunks of rows for csv
+    :param fpath: pathlib.Path, file path object
+    :param chunksize: int, max rows per chunk
+    :param columns: list of column names to load, default all
+    :param filters: row filters, see read_into_df()
+    :return: generator of pandas dataframes
+    """
+    ext = _reader_ext(fpath)
+    if ext in ('.parquet', '.arrow'):
+        dataset = _dataset(fpath)
+        expr = _filters_to_expression(filters) if filters else None
+        for batch in dataset.to_batches(columns=columns, filter=expr,
+                                        batch_size=chunksize):
+            if batch.num_rows:
+                yield batch.to_pandas()
+    elif ext == '.csv':
+        usecols = columns
+        if columns is not None and filters:
+            usecols = list(dict.fromkeys(
+                list(columns) + [f[0] for f in _filter_terms(filters)]))
+        dtype, dates = _csv_dtypes(read_csv_schema(fpath), usecols)
+        with pd.read_csv(fpath, usecols=usecols, chunksize=chunksize,
+                         dtype=dtype, parse_dates=dates) as r:
+            for chunk in r:
+                chunk = apply_filters(chunk, filters)
+                if columns is not None:
+                    chunk = chunk[list(columns)]
+                if len(chunk):
+                    yield chunk
+    else:
+        log.error(f'No chunked reader specified for extension {ext}')
+
+
+def load_preprocessed_outputs(file_metas, paths, download_if_missing=True,
+                              max_workers=4, **kwargs):
+    """
+    Loads many preprocessed files at once. Files missing locally are
+    resolved against one index per tool and category, downloaded
+    concurrently, and all files are decoded in parallel.
+    :param file_metas: list of populated instances of class FileMeta
+    :param paths: instance of class Paths
+    :param download_if_missing: bool, fetch files not found locally
+    :param max_workers: int, max number of concurrent downloads and reads
+    :param kwargs: pass-through to read_into_df() (columns, filters, compact)
+        and download_files() (e.g. subdir_dict)
+    :return: dict of name_data: dataframe, or None if unavailable
+    :raises ValueError: if several of file_metas share a name_data
+    """
+    futures = prefetch_preprocessed_outputs(
+        file_metas, paths, download_if_missing=download_if_missing,
+        max_workers=max_workers, **kwargs)
+    return {k: f.result() for k, f in futures.items()}
+
+
+def prefetch_preprocessed_outputs(file_metas, paths, download_if_missing=True,
+                                  max_workers=4, **kwargs):
+    """
+    Starts loading many preprocessed files in background threads, as in
+    load_preprocessed_outputs(), and returns at once so the caller can work
+    on each frame as soon as it is ready, e.g.
+    >>> futures = prefetch_preprocessed_outputs(metas, paths)  # doctest: +SKIP
+    >>> df = futures['USDA_CoA_Cropland_2017'].result()  # doctest: +SKIP
+    :param file_metas: list of populated instances of class FileMeta
+    :param paths: instance of class Paths
+    :param download_if_missing: bool, fetch files not found locally
+    :param max_workers: int, max number of concurrent downloads and reads
+    :param kwargs: see load_preprocessed_outputs()
+    :return: dict of name_data: concurrent.futures.Future resolving to a
+        dataframe, or None if unavailable
+    :raises ValueError: if several of file_metas share a name_data
+    """
+    names = [m.name_data for m in file_metas]
+    duplicates = sorted({n for n in names if names.count(n) > 1})
+    if duplicates:
+        raise ValueError(f'name_data must be unique among file_metas, '
+                         f'repeated: {duplicates}')
+    futures = {m.name_data: Future() for m in file_metas}
+    read_kwargs = {k: kwargs.pop(k) for k in ('columns', 'filters', 'compact')
+                   if k in kwargs}
+
+    def run():
+        executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        try:
+            if download_if_missing:
+                _download_missing(file_metas, paths, max_workers, **kwargs)
+            for m in file_metas:
+                f = find_file(m, paths)
+                if f is None:
+                    futures[m.name_data].set_result(None)
+                    continue
+                executor.submit(_resolve, futures[m.name_data], read_into_df,
+                                f, **read_kwargs)
+        except Exception as e:
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            executor.shutdown(wait=False)
+
+    threading.Thread(target=run, daemon=True).start()
+    return futures
+
+
+def _download_missing(file_metas, paths, max_workers, **kwargs):
+    """
+    Downloads files of file_metas not found locally, with a single index
+    lookup and a single concurrent download per tool and category
+    """
+    groups = {}
+    for m in file_metas:
+        if find_file(m, paths) is None:
+            groups.setdefault((m.tool, m.category), []).append(m)
+    for group in groups.values():
+        file_df = load_data_commons_index(group[0], paths)
+        files = []
+        for m in group:
+            found = get_most_recent_from_index(m, paths, file_df=file_df)
+            if found is None:
+                log.info(f'{m.name_data} not found in {paths.remote_path}')
+            else:
+                files.extend(f for f in found if f not in files)
+        download_files(files, group[0], paths, max_workers=max_workers,
+                       **kwargs)
+
+
+def _resolve(future, fn, *args, **kwargs):
+    """Sets the result or exception of calling fn on future"""
+    try:
+        future.set_result(fn(*args, **kwargs))
+    except Exception as e:
+        future.set_exception(e)
+
+
+def download_from_remote(file_meta, paths, max_workers=4, segments=1,
+                         **kwargs):
     """
     Downloads one or more files from remote and stores locally based on the
     most recent instance of that file. Most recent is determined by max
     version number. All files that share name_data, version, and hash will
-    be downloaded together.
+    be downloaded together, concurrently over a shared connection pool.
     :param file_meta: populated instance of class FileMeta
     :param paths: instance of class Paths
+    :param max_workers: int, max number of files downloaded at once
+    :param segments: int, if greater than 1, large files are fetched as
+        this many parallel byte ranges, resuming partial downloads
     :param kwargs: option to include 'subdir_dict', a dictionary that
          directs local data storage location based on extension
     :return: bool False if download fails, True if successful
     """
-    status = False
-    base_url = paths.remote_path + file_meta.tool + '/'
+    # remote_path may also be a pathlib.Path of a filesystem mirror
+    base_url = f'{str(paths.remote_path).rstrip("/")}/{file_meta.tool}/'
     if file_meta.category != '':
         base_url = base_url + file_meta.category + '/'
     files = get_most_recent_from_index(file_meta, paths)
     if files is None:
         log.info(f'{file_meta.name_data} not found in {base_url}')
-    else:
-        for fname in files:
-            url = base_url + fname
-            r = make_url_request(url)
-            if r is not None:
-                status = True
-                # set subdirectory
-                subdir = file_meta.category
-                # if there is a dictionary with specific subdirectories
-                # based on end of filename, modify the subdirectory
-                if kwargs != {}:
-                    if 'subdir_dict' in kwargs:
-                        for k, v in kwargs['subdir_dict'].items():
-                            if fname.endswith(k):
-                                subdir = v
-                folder = paths.local_path / subdir
-                mkdir_if_missing(folder)
-                file = folder / fname
-                with file.open('wb') as fi:
-                    fi.write(r.content)
-                log.info(f'{fname} downloaded from '
-                         f'{paths.remote_path}index.html?prefix='
-                         f'{file_meta.tool}/{file_meta.category} and saved to '
-                         f'{folder}')
-    return status
+        return False
+    results = download_files(files, file_meta, paths, max_workers=max_workers,
+                             segments=segments, **kwargs)
+    return any(v != 'failed' for v in results.values())
+
+
+def download_files(files, file_meta, paths, max_workers=4, segments=1,
+                   verify_checksum=False, conditional=False, **kwargs):
+    """
+    Concurrently downloads the named files from the remote folder of
+    file_meta's tool and category and stores them locally. Files are
+    streamed to disk and only moved into place once complete. The ETag,
+    Last-Modified and size of each downloaded file are recorded in the
+    folder's validator manifest.
+    :param files: list of file names, e.g. from get_most_recent_from_index()
+    :param file_meta: populated instance of class FileMeta
+    :param paths: instance of class Paths
+    :param max_workers: int, max number of files downloaded at once
+    :param segments: int, if greater than 1, large files are fetched as
+        this many parallel byte ranges, resuming partial downloads
+    :param verify_checksum: bool, check each file against its S3 ETag
+    :param conditional: bool, if True, files already stored locally are
+        only downloaded when the remote copy has changed
+    :param kwargs: option to include 'subdir_dict', a dictionary that
+         directs local data storage location based on extension
+    :return: dict of file name: str, one of 'downloaded', 'unchanged' or
+        'failed'
+    """
+    prefix = file_meta.tool + '/'
+    if file_meta.category != '':
+        prefix = prefix + file_meta.category + '/'
+    results = {}
+    if not files:
+        return results
+    targets = {fname: local_file_path(fname, file_meta, paths, **kwargs)
+               for fname in files}
+    recorded = {}
+    before = {}
+    for folder in {f.parent for f in targets.values()}:
+        recorded[folder] = read_validators(folder)
+        before[folder] = _folder_mtime(folder)
+    workers = max(1, min(max_workers, len(files)))
+    backend = get_backend(paths)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for fname, file in targets.items():
+            validators = None
+            if conditional:
+                validators = _local_validators(
+                    file, recorded[file.parent].get(fname))
+            futures[executor.submit(
+                _single_flight, backend.fetch, prefix + fname, file,
+                segments=segments,
+                verify_checksum=verify_checksum,
+                validators=validators)] = fname
+        updates = {}
+        for future in as_completed(futures):
+            fname = futures[future]
+            try:
+                r = future.result()
+            except Exception as e:
+                results[fname] = 'failed'
+                log.error(f'Failed to download {fname}: {e}')
+                continue
+            if r is None:
+                results[fname] = 'unchanged'
+                log.info(f'{fname} was downloaded by another process')
+                continue
+            if r.status_code == 304:
+                results[fname] = 'unchanged'
+                log.info(f'{fname} is up to date')
+                continue
+            results[fname] = 'downloaded'
+            v = response_validators(r)
+            v['size'] = targets[fname].stat().st_size
+            updates.setdefault(targets[fname].parent, {})[fname] = v
+            log.info(f'{fname} downloaded from {backend}')
+    for folder, v in updates.items():
+        _record_validators(folder, v)
+        update_catalog(paths, [folder / fname for fname in v],
+                       before[folder])
+    return results
+
+
+def sync_from_remote(file_meta, paths, latest_only=False, max_workers=8,
+                     force_refresh=True, **kwargs):
+    """
+    Mirrors a whole tool/category of the remote data commons into the local
+    store, downloading only files that are missing locally or that changed
+    on remote since they were downloaded, e.g. to warm up a fresh node.
+    :param file_meta: instance of class FileMeta with tool and category set
+    :param paths: instance of class Paths
+    :param latest_only: bool, only sync the highest version of each name
+    :param max_workers: int, max number of files downloaded at once
+    :param force_refresh: bool, refresh the remote index before comparing
+    :param kwargs: pass-through to download_files(), e.g. subdir_dict
+    :return: dict with counts of 'downloaded', 'unchanged' and 'failed'
+        files, 'bytes' downloaded and 'elapsed' seconds
+    """
+    start = time.time()
+    index = load_data_commons_index(file_meta, paths,
+                                    force_refresh=force_refresh)
+    if index is None or len(index) == 0:
+        log.info(f'No remote files found for {file_meta.tool}/'
+                 f'{file_meta.category}')
+        return {'downloaded': 0, 'unchanged': 0, 'failed': 0, 'bytes': 0,
+                'elapsed': time.time() - start}
+    # skip "folder" keys listed by S3
+    index = index[~index['file_name'].str.endswith('/')]
+    if latest_only:
+        index = index.assign(rank=version_rank(index['version']))
+        top = index.groupby('name')['rank'].transform('max')
+        index = index[index['rank'] == top]
+        # several hashes may share a version, keep the most recent
+        latest = index.groupby('name')['date'].transform('max')
+        hashes = index[index['date'] == latest].groupby('name')['git_hash']
+        index = index[index['git_hash'] == index['name'].map(hashes.first())]
+    recorded = {}
+    changed = []
+    for row in index.itertuples():
+        file = local_file_path(row.file_name, file_meta, paths, **kwargs)
+        if file.parent not in recorded:
+            recorded[file.parent] = read_validators(file.parent)
+        if _remote_changed(file, row, recorded[file.parent]
+                           .get(row.file_name)):
+            changed.append(row.file_name)
+    results = download_files(changed, file_meta, paths,
+                             max_workers=max_workers, **kwargs)
+    summary = {
+        'downloaded': sum(v == 'downloaded' for v in results.values()),
+        'unchanged': len(index) - len(changed) + sum(
+            v == 'unchanged' for v in results.values()),
+        'failed': sum(v == 'failed' for v in results.values()),
+        'bytes': sum(local_file_path(f, file_meta, paths, **kwargs)
+                     .stat().st_size
+                     for f, v in results.items() if v == 'downloaded'),
+        'elapsed': time.time() - start}
+    log.info(f'Synced {file_meta.tool}/{file_meta.category}: '
+             f'{summary["downloaded"]} files downloaded '
+             f'({summary["bytes"] / 1e6:.1f} MB), {summary["unchanged"]} '
+             f'unchanged, {summary["failed"]} failed in '
+             f'{summary["elapsed"]:.1f} s')
+    return summary
+
+
+def _remote_changed(file, row, recorded):
+    """
+    True if the remote file described by index row differs from the local
+    copy at file, judged by size and modification date to the second
+    """
+    try:
+        st = file.stat()
+    except FileNotFoundError:
+        return True
+    size = getattr(row, 'size', None)
+    if size is not None and not pd.isna(size) and int(size) != st.st_size:
+        return True
+    local = pd.Timestamp(st.st_mtime, unit='s', tz='UTC')
+    if recorded and recorded.get('last_modified'):
+        local = pd.Timestamp(parsedate_to_datetime(recorded['last_modified']))
+    remote = pd.Timestamp(row.date)
+    if remote.tzinfo is None:
+        remote = remote.tz_localize('UTC')
+    # recorded HTTP dates have whole-second precision, listings may not
+    return remote.floor('s') > local.floor('s')
+
+
+def _single_flight(fetch, key, file, **kwargs):
+    """
+    Calls fetch(key, file) holding the lock on file. If another process held
+    the lock and wrote file meanwhile, its result is reused and None is
+    returned instead of downloading again.
+    """
+    started = time.time()
+    with FileLock(file) as lock:
+        if lock.waited:
+            try:
+                if file.stat().st_mtime >= started:
+                    return None
+            except FileNotFoundError:
+                pass
+        return fetch(key, file, **kwargs)
+
+
+def ensure_up_to_date(file_meta, paths, force_refresh=True, **kwargs):
+    """
+    Makes sure the local store holds the most recent remote files of
+    file_meta (data, metadata and log files sharing version and hash),
+    transferring only files that are missing locally or whose remote
+    content has changed, based on recorded ETag/Last-Modified validators.
+    :param file_meta: populated instance of class FileMeta
+    :param paths: instance of class Paths
+    :param force_refresh: bool, refresh the remote index so that versions
+        published since it was cached are found
+    :param kwargs: pass-through to download_files()
+    :return: dict of file name: str, one of 'downloaded', 'unchanged' or
+        'failed'; empty if file_meta is not found on remote
+    """
+    file_df = load_data_commons_index(file_meta, paths,
+                                      force_refresh=force_refresh)
+    files = get_most_recent_from_index(file_meta, paths, file_df=file_df)
+    if files is None:
+        log.info(f'{file_meta.name_data} not found in {paths.remote_path}')
+        return {}
+    return download_files(files, file_meta, paths, conditional=True,
+                          **kwargs)
+
+
+def read_validators(folder):
+    """
+    Returns the validators recorded for files downloaded into folder
+    :param folder: pathlib.Path, local data folder
+    :return: dict of file name: dict with 'etag', 'last_modified', 'size'
+    """
+    try:
+        return json.loads((folder / VALIDATORS_FILE).read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _record_validators(folder, updates):
+    """Merges updates into the validator manifest of folder"""
+    mkdir_if_missing(folder)
+    with FileLock(folder / VALIDATORS_FILE):
+        v = read_validators(folder)
+        v.update(updates)
+        fd, tmp = tempfile.mkstemp(dir=folder, prefix='.', suffix='.tmp')
+        with os.fdopen(fd, 'w') as fi:
+            fi.write(json.dumps(v, indent=4))
+        os.replace(tmp, folder / VALIDATORS_FILE)
+
+
+def _local_validators(file, recorded):
+    """
+    Returns validators describing the local copy at file, or None if the
+    file is missing or no longer matches what was recorded at download
+    """
+    try:
+        st = file.stat()
+    except FileNotFoundError:
+        return None
+    if recorded is None:
+        # without a record, ask whether remote changed since file was written
+        return {'last_modified': formatdate(st.st_mtime, usegmt=True)}
+    if recorded.get('size') not in (None, st.st_size):
+        return None
+    return recorded
+
+
+def local_file_path(fname, file_meta, paths, **kwargs):
+    """
+    Returns the local path at which a remote file is stored
+    :param fname: str, file name
+    :param file_meta: populated instance of class FileMeta
+    :param paths: instance of class Paths
+    :param kwargs: option to include 'subdir_dict', a dictionary that
+         directs local data storage location based on extension
+    :return: pathlib.Path
+    """
+    # set subdirectory
+    subdir = file_meta.category
+    # if there is a dictionary with specific subdirectories
+    # based on end of filename, modify the subdirectory
+    for k, v in kwargs.get('subdir_dict', {}).items():
+        if fname.endswith(k):
+            subdir = v
+    return paths.local_path / subdir / fname
 
 
 def remove_extra_files(file_meta, paths):
     """
-    Removes all but the most recent file within paths.local_path based on
-    file metadata. Does not discern by version number
+    Removes all but the highest version of name_data within the category
+    folder of paths.local_path, deleting each older data file together with
+    its metadata and log files
     :param file_meta: populated instance of class FileMeta
     :param paths: populated instance of class Paths
     """
-    path = paths.local_path / file_meta.category
-    fs = {}
-    file_name = file_meta.name_data + '_v'
-    for f in os.scandir(str(path)):
-        name = f.name
-        # get file creation time (Windows) or most recent metadata change time (Unix)
-        # TODO: refactor w/ recursive glob: path.rglob('*')
-        st = f.stat().st_ctime
-        if name.startswith(file_name):
-            fs[name] = st
-    keep = max(fs, key=fs.get)
-    log.debug(f'found {len(fs)} files')
+    folder = paths.local_path / file_meta.category
+    bundles = [b for b in _local_bundles(folder)
+               if b['name'] == file_meta.name_data]
+    log.debug(f'found {len(bundles)} versions')
+    if not bundles:
+        return
+    keep = max(bundles, key=lambda b: (version_key(b['version']),
+                                       b['mtime']))
     count = 0
-    for f in fs.keys():
-        if f is not keep:
-            os.remove(path + '/' + f)
-            count += 1
+    for b in bundles:
+        if b is not keep:
+            count += _remove_bundle(b) or 0
     log.debug(f'removed {count} files')
 
 
+def collect_garbage(paths, quota_bytes, dry_run=False):
+    """
+    Shrinks the local data store below quota_bytes by deleting the least
+    recently accessed dataset versions. Only the folders esupy has read
+    from or written to (see managed_folders()) are searched, without
+    descending into subfolders, and only versioned esupy files
+    ({name}_v{version}... with a data extension such as parquet or csv)
+    count toward the quota and can be deleted. A data file is always
+    deleted together with its metadata and log files, the highest version
+    of each dataset in each folder is always kept, and versions locked by
+    another process are skipped.
+    :param paths: instance of class Paths
+    :param quota_bytes: int, target size of the store in bytes
+    :param dry_run: bool, report what would be deleted without deleting
+    :return: dataframe with one row per dataset version: folder, name,
+        version, git_hash, files, bytes, last_access and action, one of
+        'keep latest', 'keep', 'locked' or 'evict'
+    """
+    bundles = [b for folder in managed_folders(paths)
+               for b in _local_bundles(folder)]
+    latest = {}
+    for b in bundles:
+        k = (b['folder'], b['name'])
+        if k not in latest or (version_key(b['version']), b['mtime']) > (
+                version_key(latest[k]['version']), latest[k]['mtime']):
+            latest[k] = b
+    for b in bundles:
+        b['action'] = 'keep'
+    for b in latest.values():
+        b['action'] = 'keep latest'
+    total = sum(b['bytes'] for b in bundles)
+    evicted = 0
+    for b in sorted(bundles, key=lambda b: b['last_access']):
+        if total <= quota_bytes:
+            break
+        if b['action'] == 'keep latest':
+            continue
+        if dry_run:
+            locked = _bundle_locked(b)
+        else:
+            locked = _remove_bundle(b) is None
+        if locked:
+            b['action'] = 'locked'
+            continue
+        b['action'] = 'evict'
+        total -= b['bytes']
+        evicted += b['bytes']
+    if total > quota_bytes:
+        log.warning(f'Local store remains at {total} bytes, above quota of '
+                    f'{quota_bytes}, after evicting all but latest versions')
+    log.info(f'{"Would evict" if dry_run else "Evicted"} '
+             f'{sum(b["action"] == "evict" for b in bundles)} dataset '
+             f'versions, {evicted / 1e6:.1f} MB')
+    report = pd.DataFrame(
+        [{'folder': str(b['folder']), 'name': b['name'],
+          'version': b['version'], 'git_hash': b['git_hash'],
+          'files': [f.name for f in b['files']], 'bytes': b['bytes'],
+          'last_access': pd.to_datetime(b['last_access'], unit='s'),
+          'action': b['action']} for b in bundles],
+        columns=['folder', 'name', 'version', 'git_hash', 'files', 'bytes',
+                 'last_access', 'action'])
+    return report.sort_values('last_access').reset_index(drop=True)
+
+
+def managed_folders(paths):
+    """
+    Returns the folders below paths.local_path that esupy has read data
+    from or written data to, as registered by their catalogs. Other
+    folders, e.g. of other applications sharing the default user data
+    directory, are never modified by store-wide operations.
+    :param paths: instance of class Paths
+    :return: list of pathlib.Path
+    """
+    root = Path(paths.local_path)
+    folders = set()
+    for f in (root / '.catalog' / 'folders').glob('*'):
+        try:
+            folder = Path(f.read_text())
+        except (FileNotFoundError, ValueError):
+            continue
+        if (folder == root or root in folder.parents) and folder.is_dir():
+            folders.add(folder)
+    return sorted(folders)
+
+
+def _register_folder(folder, paths):
+    """Records folder as holding esupy data, see managed_folders()"""
+    marker = catalog_path(folder, paths).with_suffix('')
+    marker = marker.parent / 'folders' / marker.name
+    if marker in _registered:
+        return
+    if not marker.exists():
+        mkdir_if_missing(marker.parent)
+        fd, tmp = tempfile.mkstemp(dir=marker.parent, prefix='.',
+                                   suffix='.tmp')
+        with os.fdopen(fd, 'w') as fi:
+            fi.write(str(folder))
+        os.replace(tmp, marker)
+    _registered.add(marker)
+
+
+# extensions of data files a bundle of versioned files must include, and of
+# all files that may belong to one
+DATA_EXT = {'parquet', 'csv', 'csv.gz', 'csv.zst', 'arrow', 'rds'}
+BUNDLE_EXT = DATA_EXT | {'json', 'txt'}
+
+
+def _local_bundles(folder):
+    """
+    Groups the versioned esupy files in folder, not searching subfolders,
+    into bundles sharing name, version and git_hash, e.g. a data file with
+    its metadata and log files. Folders only count as partitioned parquet
+    datasets when they hold a _common_metadata file.
+    :return: list of dict with folder, name, version, git_hash, files,
+        bytes, mtime and last_access
+    """
+    bundles = {}
+    try:
+        entries = list(os.scandir(folder))
+    except FileNotFoundError:
+        return []
+    for f in entries:
+        if f.name.startswith('.'):
+            continue
+        parsed = parse_file_name(f.name)
+        if parsed['version'] == '' or parsed['ext'].lower() not in BUNDLE_EXT:
+            continue
+        path = Path(f.path)
+        if f.is_dir() and not (parsed['ext'] == 'parquet' and
+                               (path / '_common_metadata').is_file()):
+            continue
+        k = (parsed['name'], parsed['version'], parsed['git_hash'])
+        b = bundles.setdefault(k, {
+            'folder': folder, 'name': parsed['name'],
+            'version': parsed['version'], 'git_hash': parsed['git_hash'],
+            'files': [], 'bytes': 0, 'mtime': 0, 'last_access': 0,
+            'has_data': False})
+        b['has_data'] |= parsed['ext'].lower() in DATA_EXT
+        members = [path]
+        if parsed['ext'] == 'rds':
+            members.append(rds_sidecar_path(path))
+        for m in members:
+            size, st = _tree_size(m)
+            if st is None:
+                continue
+            b['files'].append(m)
+            b['bytes'] += size
+            b['mtime'] = max(b['mtime'], st.st_mtime)
+            b['last_access'] = max(b['last_access'], st.st_atime,
+                                   st.st_mtime)
+    return [b for b in bundles.values() if b.pop('has_data')]
+
+
+def _tree_size(path):
+    """Returns total bytes below path and the stat result of path"""
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return 0, None
+    if not path.is_dir():
+        return st.st_size, st
+    return sum(f.stat().st_size for f in path.rglob('*')
+               if f.is_file()), st
+
+
+def _remove_bundle(bundle):
+    """
+    Deletes all files of a bundle while holding their locks, returns the
+    count deleted, or None if another process holds a lock on any of them
+    """
+    with ExitStack() as stack:
+        for f in bundle['files']:
+            try:
+                stack.enter_context(FileLock(f, timeout=0))
+            except TimeoutError:
+                log.info(f'Skipped {f.name}, in use by another process')
+                return None
+        count = 0
+        for f in bundle['files']:
+            try:
+                if f.is_dir():
+                    shutil.rmtree(f)
+                else:
+                    f.unlink()
+                df_cache.invalidate(f)
+                count += 1
+            except FileNotFoundError:
+                pass
+    return count
+
+
+def _bundle_locked(bundle):
+    """True if another process holds a lock on a file of bundle"""
+    return any(FileLock(f).lock_path.exists() for f in bundle['files'])
+
+
 def find_file(meta, paths):
     """
     Searches for file within path.local_path based on file metadata; if
-    metadata matches, returns most recently created file path object
+    metadata matches, returns the file path object of the highest version,
+    most recently modified. Lookups use the folder's local file catalog.
     :param meta: populated instance of class FileMeta
     :param paths: populated instance of class Paths
-    :return: str with the file path if found, otherwise an empty string
-    """
-    path = paths.local_path / meta.category
-    if path.exists():
-        # TODO: refactor w/ recursive glob: path.rglob('*')
-        with os.scandir(str(path)) as files:
-            # List all file satisfying the criteria in the passed metadata
-            matches = [f for f in files
-                       if f.name.startswith(meta.name_data)
-                       and meta.ext.lower() in f.name.lower()]
-            # Sort files in reverse order by ctime (creation time on Windows,
-            # last metadata modification time on Unix)
-            sorted_matches = sorted(matches,
-                                    key=lambda f: f.stat().st_ctime,
-                                    reverse=True)
-        # Return the path to the most recent matching file, or '' if no
-        # match exists.
-        if sorted_matches:
-            return path / sorted_matches[0].name
-    return None
-
-
-def get_most_recent_from_index(file_meta, paths):
+    :return: pathlib.Path if found, otherwise None
+    """
+    folder = paths.local_path / meta.category
+    catalog = load_catalog(folder, paths)
+    if catalog is None:
+        return None
+    ext = meta.ext.lower()
+    fname = catalog['latest'].get(f'{meta.name_data}|{ext}')
+    if fname is None:
+        # name_data may include a version and hash, match on file prefix
+        matches = [(k, v) for k, v in catalog['files'].items()
+                   if k.startswith(meta.name_data) and ext in k.lower()]
+        if not matches:
+            return None
+        fname = max(matches, key=lambda kv: _catalog_sort_key(kv[1]))[0]
+    return folder / fname
+
+
+def load_catalog(folder, paths, refresh=False):
+    """
+    Returns the catalog of files stored in a local data folder, rebuilding
+    it from disk when the folder has changed since the catalog was saved.
+    The catalog is a dict with 'files', a dict of file name: parsed name,
+    version, git_hash, ext and mtime, and 'latest', a dict of
+    'name|ext': file name of the highest version.
+    :param folder: pathlib.Path, local data folder
+    :param paths: instance of class Paths
+    :param refresh: bool, True to rebuild the catalog regardless
+    :return: dict, or None if folder does not exist
+    """
+    mtime = _folder_mtime(folder)
+    if mtime is None:
+        return None
+    _register_folder(folder, paths)
+    cache = catalog_path(folder, paths)
+    if not refresh:
+        catalog = _catalogs.get(cache)
+        if catalog is None:
+            try:
+                catalog = json.loads(cache.read_text())
+            except (FileNotFoundError, ValueError):
+                catalog = None
+        if catalog is not None and catalog['mtime_ns'] == mtime:
+            _catalogs[cache] = catalog
+            return catalog
+    mkdir_if_missing(cache.parent)
+    # record folder mtime before scanning, so changes during the scan make
+    # the saved catalog stale
+    mtime = _folder_mtime(folder)
+    files = {}
+    with os.scandir(folder) as entries:
+        for f in entries:
+            if not f.name.startswith('.'):
+                files[f.name] = _catalog_entry(f.name, f.stat().st_mtime)
+    catalog = {'mtime_ns': mtime, 'files': files,
+               'latest': _catalog_latest(files)}
+    _save_catalog(catalog, cache)
+    return catalog
+
+
+def catalog_path(folder, paths):
+    """
+    Returns the path at which the catalog of a local data folder is saved
+    :param folder: pathlib.Path, local data folder
+    :param paths: instance of class Paths
+    :return: pathlib.Path
+    """
+    try:
+        name = folder.relative_to(paths.local_path).as_posix()
+    except ValueError:
+        name = folder.as_posix()
+    name = name.strip('/').replace('/', '_').replace(':', '') or '_root'
+    return paths.local_path / '.catalog' / f'{name}.json'
+
+
+def update_catalog(paths, files, before):
+    """
+    Adds newly written files to the catalog of their folder. If the folder
+    changed in other ways since before, the catalog is instead left to be
+    rebuilt on next use. Files that other processes added or removed while
+    these were written are merged in from a listing of the folder.
+    :param paths: instance of class Paths
+    :param files: list of pathlib.Path, written files sharing one folder
+    :param before: int, folder mtime in ns recorded prior to writing
+    """
+    if not files:
+        return
+    folder = files[0].parent
+    _register_folder(folder, paths)
+    cache = catalog_path(folder, paths)
+    catalog = _catalogs.get(cache)
+    if catalog is None or catalog['mtime_ns'] != before:
+        return
+    # record folder mtime before listing, so changes after the listing make
+    # the saved catalog stale
+    mtime = _folder_mtime(folder)
+    with os.scandir(folder) as entries:
+        names = {f.name for f in entries if not f.name.startswith('.')}
+    known = {k: v for k, v in catalog['files'].items() if k in names}
+    for f in files:
+        known[f.name] = _catalog_entry(f.name, f.stat().st_mtime)
+    for name in names - known.keys():
+        try:
+            known[name] = _catalog_entry(
+                name, (folder / name).stat().st_mtime)
+        except FileNotFoundError:
+            continue
+    catalog = {'mtime_ns': mtime, 'files': known,
+               'latest': _catalog_latest(known)}
+    _save_catalog(catalog, cache)
+
+
+def parse_file_name(fname):
+    """
+    Parses a file name of the form {name}_v{version}_{git_hash}_{suffix}.ext
+    where version, git_hash and suffix (e.g. 'metadata', 'log') are optional
+    :param fname: str, file name
+    :return: dict of name, version, git_hash, suffix, ext; values missing
+        from the file name are ''
+    """
+    m = FILE_NAME_PATTERN.match(fname)
+    if m is None:
+        return {'name': fname, 'version': '', 'git_hash': '', 'suffix': '',
+                'ext': ''}
+    return {k: v or '' for k, v in m.groupdict().items()}
+
+
+def version_key(version):
+    """
+    Returns a sort key ordering version strings numerically, so that
+    '1.10.0' sorts above '1.9.0'
+    :param version: str
+    :return: tuple of int
+    """
+    m = re.match(r'\d+(?:\.\d+)*', version or '')
+    return tuple(int(x) for x in m.group().split('.')) if m else ()
+
+
+def _catalog_entry(fname, mtime):
+    entry = parse_file_name(fname)
+    entry['mtime'] = mtime
+    return entry
+
+
+def _catalog_sort_key(entry):
+    return version_key(entry['version']), entry['mtime']
+
+
+def _catalog_latest(files):
+    """Returns dict of 'name|ext': file name with the highest version"""
+    latest = {}
+    for fname, entry in files.items():
+        ext = entry['ext'].lower()
+        # compressed files, e.g. csv.gz, also count as their base ext
+        for key in {f'{entry["name"]}|{ext}',
+                    f'{entry["name"]}|{ext.split(".")[0]}'}:
+            if key not in latest or (_catalog_sort_key(entry) >
+                                     _catalog_sort_key(files[latest[key]])):
+                latest[key] = fname
+    return latest
+
+
+def _save_catalog(catalog, cache):
+    _catalogs[cache] = catalog
+    fd, tmp = tempfile.mkstemp(dir=cache.parent, prefix='.', suffix='.tmp')
+    with os.fdopen(fd, 'w') as fi:
+        fi.write(json.dumps(catalog))
+    os.replace(tmp, cache)
+
+
+def _folder_mtime(folder):
+    try:
+        return folder.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def get_most_recent_from_index(file_meta, paths, file_df=None):
     """
     Sorts the data commons index by most recent date for the required extension
     and returns the matching files of that name that share the same version
     and hash
     :param file_meta:
     :param paths:
+    :param file_df: parsed index to search, to reuse one index across many
+        lookups; by default loaded via load_data_commons_index()
     :return: list, most recently created datafiles, metadata, log files
     """
-
-    file_df = get_data_commons_index(file_meta, paths)
+    if file_df is None:
+        file_df = load_data_commons_index(file_meta, paths)
     if file_df is None:
         return None
-    file_df = parse_data_commons_index(file_df)
     # subset using "file_name" instead of "name" to work when a user
     # includes a GitHub version and hash
     df = file_df[file_df['file_name'].str.startswith(file_meta.name_data)]
     df_ext = df[df['ext'] == file_meta.ext]
     if len(df_ext) == 0:
         return None
-    else:
-        df_ext = (df_ext.sort_values(by=["version", "date"], ascending=False)
-                  .reset_index(drop=True))
-        # select first file name in list, extract the file version and git
-        # hash, return list of files that include version/hash (to include
-        # metadata and log files)
-        recent_file = df_ext['file_name'][0]
-        vh = '_'.join(strip_file_extension(recent_file).replace(
-            f'{file_meta.name_data}_', '').split('_', 2)[:2])
-        if vh != '':
-            df_sub = [string for string in df['file_name'] if vh in string]
-        else:
-            df_sub = [recent_file]
-        return df_sub
+    # select the most recent file of the highest version, then return all
+    # files that share its name, version and hash (to include metadata and
+    # log files)
+    df_ext = df_ext.assign(rank=version_rank(df_ext['version']))
+    recent = df_ext.sort_values(by=['rank', 'date'], ascending=False).iloc[0]
+    if recent['version'] == '':
+        return [recent['file_name']]
+    df_sub = df[(df['name'] == recent['name']) &
+                (df['version'] == recent['version']) &
+                (df['git_hash'] == recent['git_hash'])]
+    return list(df_sub['file_name'])
 
 
-def write_df_to_file(df, paths, meta):
+def write_df_to_file(df, paths, meta, partition_cols=None,
+                     compression='snappy', row_group_size=None,
+                     use_dictionary=True, compact=False):
     """
     Writes a data frame to the designated local folder and file name created
     using paths and meta
     :param df: a pandas dataframe
     :param paths: populated instance of class Paths
     :param meta: populated instance of class FileMeta
+    :param partition_cols: list of columns, e.g. ['Year', 'Location']; for
+        parquet, writes a hive-partitioned dataset folder named as the file
+        would be, which readers can prune by partition
+    :param compression: str, parquet codec, e.g. 'snappy', 'zstd' or None;
+        for csv, 'gzip' or 'zstd' write a compressed .csv.gz or .csv.zst
+    :param row_group_size: int, max rows per parquet row group
+    :param use_dictionary: bool or list of columns, parquet dictionary
+        encoding
+    :param compact: bool, store low-cardinality strings as categoricals,
+        restored as such by parquet and arrow readers, see compact_df()
     :return: None
     """
+    if compact:
+        df = compact_df(df)
     folder = paths.local_path / meta.category
     fname = f'{meta.name_data}_v{meta.tool_version}'
     if meta.git_hash is not None:
         fname = f'{fname}_{meta.git_hash}'
+    suffix = {'parquet': '.parquet', 'arrow': '.arrow',
+              'csv': f'.csv{CSV_COMPRESSION.get(compression, "")}'}
+    if meta.ext not in suffix:
+        log.error(f'Failed to save {fname}; metadata lacks "ext" property')
+        return
+    file = folder / f'{fname}{suffix[meta.ext]}'
     try:
         mkdir_if_missing(folder)
-        if meta.ext == "parquet":
-            df.to_parquet(folder / f'{fname}.parquet')
-        elif meta.ext == "csv":
-            df.to_csv(folder / f'{fname}.csv', index=False)
-        else:
-            log.error(f'Failed to save {fname}; metadata lacks "ext" property')
+        # other processes writing the same file wait for this one
+        with FileLock(file):
+            before = _folder_mtime(folder)
+            if meta.ext == "parquet" and partition_cols:
+                write_parquet_dataset(df, file, partition_cols,
+                                      compression=compression,
+                                      row_group_size=row_group_size,
+                                      use_dictionary=use_dictionary)
+            elif meta.ext == "parquet":
+                if file.is_dir():
+                    shutil.rmtree(file)
+                _write_atomic(file, lambda tmp: df.to_parquet(
+                    tmp, compression=compression,
+                    row_group_size=row_group_size,
+                    use_dictionary=use_dictionary))
+            elif meta.ext == "csv":
+                _write_atomic(file, lambda tmp: df.to_csv(
+                    tmp, index=False,
+                    compression=compression if compression in
+                    CSV_COMPRESSION else None))
+                meta.schema = csv_schema(df)
+            elif meta.ext == "arrow":
+                write_arrow(df, file)
     except Exception as e:
         log.exception(f'Failed to save {fname}')
         raise e
+    df_cache.invalidate(file)
+    update_catalog(paths, [file], before)
 
 
-def read_into_df(fpath):
+def _write_atomic(file, write):
+    """
+    Calls write with a temporary path next to file, then renames the result
+    to file so readers never see a partially written file
+    """
+    fd, tmp = tempfile.mkstemp(dir=file.parent, prefix=f'.{file.name}.',
+                               suffix='.tmp')
+    os.close(fd)
+    try:
+        write(tmp)
+        os.replace(tmp, file)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def write_parquet_dataset(df, path, partition_cols, compression='snappy',
+                          row_group_size=None, use_dictionary=True):
+    """
+    Writes df as a hive-partitioned parquet dataset in folder path, e.g.
+    path/Year=2017/Location=US/part-0.parquet, replacing any existing
+    dataset or file at path once the new dataset is complete. The full
+    schema, including partition column types, is saved in
+    path/_common_metadata so the dataset reads back with the original dtypes.
+    :param df: pandas dataframe
+    :param path: pathlib.Path, dataset folder
+    :param partition_cols: list of columns to partition by
+    :param compression: str, parquet codec
+    :param row_group_size: int, max rows per row group
+    :param use_dictionary: bool or list of columns, dictionary encoding
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    schema = table.schema.with_metadata({
+        **(table.schema.metadata or {}),
+        PARTITION_KEY: json.dumps(list(partition_cols)).encode()})
+    options = ds.ParquetFileFormat().make_write_options(
+        compression=compression, use_dictionary=use_dictionary)
+    kwargs = {}
+    if row_group_size is not None:
+        kwargs = {'max_rows_per_group': row_group_size,
+                  'min_rows_per_group': min(row_group_size, 1024 * 1024)}
+    tmp = Path(tempfile.mkdtemp(dir=path.parent, prefix=f'.{path.name}.'))
+    try:
+        ds.write_dataset(
+            table, tmp, format='parquet', file_options=options,
+            partitioning=ds.partitioning(
+                pa.schema([schema.field(c) for c in partition_cols]),
+                flavor='hive'),
+            basename_template='part-{i}.parquet',
+            existing_data_behavior='overwrite_or_ignore', **kwargs)
+        pq.write_metadata(schema, tmp / '_common_metadata')
+        if path.is_dir():
+            old = Path(tempfile.mkdtemp(dir=path.parent,
+                                        prefix=f'.{path.name}.'))
+            os.replace(path, old / path.name)
+            os.replace(tmp, path)
+            shutil.rmtree(old, ignore_errors=True)
+        else:
+            if path.exists():
+                path.unlink()
+            os.replace(tmp, path)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+
+def read_parquet_dataset(path, columns=None, filters=None):
+    """
+    Reads a partitioned dataset written by write_parquet_dataset() as one
+    dataframe, pruning partitions and row groups that can not match filters
+    :param path: pathlib.Path, dataset folder
+    :param columns: list of column names to load, default all
+    :param filters: see read_into_df()
+    :return: pandas dataframe
+    """
+    dataset = _dataset(path)
+    expr = _filters_to_expression(filters) if filters else None
+    df = dataset.to_table(columns=columns, filter=expr).to_pandas()
+    # partition columns are appended last, restore the written order
+    try:
+        names = pq.read_schema(path / '_common_metadata').names
+    except FileNotFoundError:
+        return df
+    order = columns if columns is not None else names
+    return df[[c for c in order if c in df.columns]]
+
+
+def write_arrow(df, file):
+    """
+    Writes df as an uncompressed Arrow IPC file, which readers can memory-map
+    instead of decoding. The file is written beside file and renamed into
+    place once complete.
+    :param df: pandas dataframe or pyarrow.Table
+    :param file: pathlib.Path, destination file ending in .arrow
+    """
+    table = df
+    if isinstance(df, pd.DataFrame):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    _write_atomic(file, lambda tmp: feather.write_feather(
+        table, tmp, compression='uncompressed'))
+
+
+def read_arrow_table(fpath, columns=None, filters=None):
+    """
+    Memory-maps an Arrow IPC file as a pyarrow.Table. Buffers are read
+    zero-copy from the page cache, so processes on one node reading the same
+    file share its memory.
+    :param fpath: pathlib.Path, file ending in .arrow
+    :param columns: list of column names to load, default all
+    :param filters: see read_into_df()
+    :return: pyarrow.Table
+    """
+    expr = _filters_to_expression(filters) if filters else None
+    return _dataset(fpath).to_table(columns=columns, filter=expr)
+
+
+def _dataset(fpath):
+    """
+    Returns a pyarrow dataset over a parquet file, partitioned parquet
+    dataset folder or memory-mapped arrow file
+    """
+    if fpath.suffix.lower() == '.arrow':
+        return ds.dataset(str(fpath), format='arrow',
+                          filesystem=LocalFileSystem(use_mmap=True))
+    partitioning = 'hive'
+    if fpath.is_dir():
+        try:
+            schema = pq.read_schema(fpath / '_common_metadata')
+            cols = json.loads(schema.metadata[PARTITION_KEY])
+            partitioning = ds.partitioning(
+                pa.schema([schema.field(c) for c in cols]), flavor='hive')
+        except (FileNotFoundError, KeyError, TypeError):
+            log.debug(f'No partition schema found for {fpath}')
+    return ds.dataset(str(fpath), format='parquet', partitioning=partitioning)
+
+
+def _filters_to_expression(filters):
+    """Converts filters in pyarrow DNF form to a dataset expression"""
+    to_expression = getattr(pq, 'filters_to_expression', None) or \
+        pq._filters_to_expression
+    return to_expression(filters)
+
+
+def convert_to_arrow(paths, category=None, remove_source=False):
+    """
+    Converts parquet files in the local store to Arrow IPC files of the same
+    name with extension .arrow, e.g. to share data among worker processes.
+    Only folders esupy manages (see managed_folders()) are converted.
+    Existing .arrow files that are newer than their source are kept.
+    :param paths: instance of class Paths
+    :param category: str, subfolder of paths.local_path to convert, default
+        all folders
+    :param remove_source: bool, delete each parquet file once converted
+    :return: list of pathlib.Path, the .arrow files written
+    """
+    root = paths.local_path / category if category else paths.local_path
+    written = []
+    for folder in managed_folders(paths):
+        if not (folder == root or root in folder.parents):
+            continue
+        for src in sorted(folder.glob('*.parquet')):
+            # skip hidden files and folders that are not parquet datasets
+            if src.name.startswith('.') or (
+                    src.is_dir() and
+                    not (src / '_common_metadata').is_file()):
+                continue
+            target = src.with_suffix('.arrow')
+            if not (target.exists() and
+                    target.stat().st_mtime >= src.stat().st_mtime):
+                before = _folder_mtime(src.parent)
+                table = pa.Table.from_pandas(read_into_df(src),
+                                             preserve_index=False)
+                write_arrow(table, target)
+                update_catalog(paths, [target], before)
+                written.append(target)
+                log.info(f'Converted {src.name} to {target.name}')
+            if remove_source:
+                _remove_bundle({'files': [src]})
+    return written
+
+
+def read_into_df(fpath, columns=None, filters=None, compact=False):
     """
     Based on a file extension use the appropriate function to read in file
     :param fpath: pathlib.Path, file path object
+    :param columns: list of column names to load, default all
+    :param filters: row filters in pyarrow DNF form, a list of
+        (column, op, value) tuples combined with AND, or a list of such
+        lists combined with OR, e.g. [('Year', '=', 2017)]; op is one of
+        =, ==, !=, <, <=, >, >=, in, not in. Parquet files skip row groups
+        that can not match.
+    :param compact: bool, return low-cardinality strings as categoricals
+        and downcast numbers, see compact_df()
     :return: a pandas dataframe with the file data if extension is handled,
         else an error
     """
-    ext = fpath.suffix.lower()
-    if ext == '.parquet':
-        df = pd.read_parquet(fpath)
+    key = None
+    if df_cache.enabled:
+        key = df_cache.make_key(fpath, columns, filters, compact)
+        df = df_cache.get(key)
+        if df is not None:
+            return df
+    ext = _reader_ext(fpath)
+    if ext == '.parquet' and fpath.is_dir():
+        df = read_parquet_dataset(fpath, columns=columns, filters=filters)
+    elif ext == '.parquet':
+        df = pd.read_parquet(fpath, columns=columns, filters=filters)
+    elif ext == '.arrow':
+        df = read_arrow_table(fpath, columns=columns, filters=filters
+                              ).to_pandas(split_blocks=True)
     elif ext == '.csv':
-        df = pd.read_csv(fpath)
+        usecols = columns
+        if columns is not None and filters:
+            # filter columns are needed to apply filters, drop after
+            usecols = list(dict.fromkeys(
+                list(columns) + [f[0] for f in _filter_terms(filters)]))
+        df = read_csv(fpath, usecols=usecols)
+        df = apply_filters(df, filters)
+        if columns is not None:
+            df = df[list(columns)]
     elif ext == '.rds':
-        try:
-            import rpy2.robjects as robjects
-            from rpy2.robjects import pandas2ri
-        except ImportError:
-            log.error('Must install rpy2 to read .rds files')
-        pandas2ri.activate()
-        readRDS = robjects.r['readRDS']
-        df = readRDS(str(fpath))
-        # ^ readRDS can not handle Path objects
+        df = read_rds(fpath, columns=columns, filters=filters)
     else:
         log.error(f'No reader specified for extension {ext}')
+    if compact:
+        df = compact_df(df)
+    if key is not None and isinstance(df, pd.DataFrame):
+        df_cache.put(key, df)
+    return df
+
+
+def compact_df(df, max_unique_ratio=0.5, downcast=True,
+               downcast_floats=False):
+    """
+    Reduces the memory of df by converting string columns with few distinct
+    values (e.g. Flowable, Context, Unit, SourceName, Location, FlowUUID) to
+    categoricals, and downcasting numeric columns where no values change.
+    Logs the memory saved.
+    :param df: pandas dataframe
+    :param max_unique_ratio: float, convert string columns whose share of
+        distinct values is at most this
+    :param downcast: bool, downcast integer columns
+    :param downcast_floats: bool, also downcast float64 columns to float32
+        when values are unchanged; later arithmetic is then float32
+    :return: pandas dataframe
+    """
+    before = df.memory_usage(deep=True).sum()
+    df = df.copy()
+    for col in df.columns:
+        s = df[col]
+        if pd.api.types.is_object_dtype(s) or \
+                pd.api.types.is_string_dtype(s):
+            if len(s) > 0 and s.nunique() / len(s) <= max_unique_ratio:
+                df[col] = s.astype('category')
+        elif downcast and pd.api.types.is_integer_dtype(s) and \
+                not pd.api.types.is_extension_array_dtype(s):
+            df[col] = pd.to_numeric(s, downcast='integer')
+        elif downcast_floats and pd.api.types.is_float_dtype(s) and \
+                not pd.api.types.is_extension_array_dtype(s):
+            s32 = s.astype('float32')
+            if s32.astype(s.dtype).equals(s):
+                df[col] = s32
+    after = df.memory_usage(deep=True).sum()
+    log.info(f'Compacted dataframe from {before / 1e6:.1f} MB to '
+             f'{after / 1e6:.1f} MB, saving {(before - after) / 1e6:.1f} MB')
+    return df
+
+
+def read_rds(fpath, columns=None, filters=None, transcode=True):
+    """
+    Reads an .rds file. The first successful read through R (rpy2) is
+    transcoded to a hidden parquet sidecar next to the .rds file, keyed on
+    the size and mtime of the source; later reads of an unchanged source use
+    the sidecar and never start R.
+    :param fpath: pathlib.Path, .rds file
+    :param columns: list of column names to load, default all
+    :param filters: row filters, see read_into_df()
+    :param transcode: bool, write the sidecar after reading through R
+    :return: a pandas dataframe, or the converted R object if it is not a
+        data frame
+    """
+    sidecar = rds_sidecar_path(fpath)
+    key = _rds_source_key(fpath)
+    try:
+        if pq.read_schema(sidecar).metadata.get(RDS_SOURCE_KEY) == key:
+            return pd.read_parquet(sidecar, columns=columns, filters=filters)
+    except (FileNotFoundError, AttributeError, pa.ArrowInvalid):
+        pass
+    try:
+        import rpy2.robjects as robjects
+        from rpy2.robjects import pandas2ri
+    except ImportError:
+        log.error('Must install rpy2 to read .rds files')
+        raise
+    pandas2ri.activate()
+    readRDS = robjects.r['readRDS']
+    df = readRDS(str(fpath))
+    # ^ readRDS can not handle Path objects
+    if not isinstance(df, pd.DataFrame):
+        return df
+    if transcode:
+        try:
+            table = pa.Table.from_pandas(df)
+            table = table.replace_schema_metadata(
+                {**(table.schema.metadata or {}), RDS_SOURCE_KEY: key})
+            fd, tmp = tempfile.mkstemp(dir=sidecar.parent,
+                                       prefix=f'{sidecar.name}.',
+                                       suffix='.tmp')
+            os.close(fd)
+            pq.write_table(table, tmp)
+            os.replace(tmp, sidecar)
+            log.info(f'Transcoded {fpath.name} to {sidecar.name}')
+        except Exception as e:
+            log.warning(f'Unable to transcode {fpath.name} to parquet: {e}')
+    df = apply_filters(df, filters)
+    if columns is not None:
+        df = df[list(columns)]
     return df
 
+
+def transcode_rds_dir(folder, recursive=True):
+    """
+    Pre-transcodes all .rds files in folder to parquet sidecars so that no
+    later read_into_df() call needs to start R
+    :param folder: pathlib.Path
+    :param recursive: bool, include subfolders
+    :return: list of pathlib.Path, the .rds files transcoded
+    """
+    files = folder.rglob('*.rds') if recursive else folder.glob('*.rds')
+    done = []
+    for f in sorted(files):
+        try:
+            read_rds(f)
+            done.append(f)
+        except Exception as e:
+            log.error(f'Unable to transcode {f}: {e}')
+    return done
+
+
+def rds_sidecar_path(fpath):
+    """
+    Returns the path of the hidden parquet transcode of an .rds file
+    :param fpath: pathlib.Path, .rds file
+    :return: pathlib.Path
+    """
+    return fpath.parent / f'.{fpath.name}.parquet'
+
+
+def _rds_source_key(fpath):
+    st = fpath.stat()
+    return json.dumps({'size': st.st_size,
+                       'mtime_ns': st.st_mtime_ns}).encode()
+
+
+def csv_schema(df):
+    """
+    Returns the column dtypes of df for recording in the metadata JSON, so
+    readers can skip dtype inference and keep zero-padded codes as strings
+    :param df: pandas dataframe
+    :return: dict of column: dtype name
+    """
+    return {str(col): str(dtype) for col, dtype in df.dtypes.items()}
+
+
+def read_csv_schema(fpath):
+    """
+    Returns the column schema recorded in the metadata JSON of a csv file
+    :param fpath: pathlib.Path, csv file
+    :return: dict of column: dtype name, or None if unavailable
+    """
+    try:
+        return json.loads(metadata_path(fpath).read_text()).get('schema')
+    except (FileNotFoundError, ValueError, AttributeError):
+        return None
+
+
+def read_csv(fpath, usecols=None):
+    """
+    Reads a csv file, optionally gzip or zstd compressed. When the metadata
+    JSON records the column schema, columns are read with explicit types by
+    the multithreaded pyarrow csv reader instead of being inferred.
+    :param fpath: pathlib.Path, csv file
+    :param usecols: list of column names to load, default all
+    :return: pandas dataframe
+    """
+    schema = read_csv_schema(fpath)
+    if schema is None:
+        return pd.read_csv(fpath, usecols=usecols)
+    types = {}
+    for col, t in schema.items():
+        if t in ('object', 'str', 'string', 'category'):
+            # categories are read as strings, converted below
+            types[col] = pa.string()
+        else:
+            try:
+                types[col] = pa.from_numpy_dtype(np.dtype(t))
+            except TypeError:
+                pass
+    try:
+        table = pa_csv.read_csv(fpath, convert_options=pa_csv.ConvertOptions(
+            column_types=types, include_columns=usecols,
+            strings_can_be_null=True))
+    except (pa.ArrowInvalid, NotImplementedError) as e:
+        log.debug(f'pyarrow could not read {fpath.name}, using pandas: {e}')
+        dtype, dates = _csv_dtypes(schema, usecols)
+        return pd.read_csv(fpath, usecols=usecols, dtype=dtype,
+                           parse_dates=dates)
+    df = table.to_pandas()
+    categories = [c for c, t in schema.items()
+                  if t == 'category' and c in df.columns]
+    return df.astype({c: 'category' for c in categories})
+
+
+def _csv_dtypes(schema, usecols=None):
+    """Splits a recorded schema into read_csv dtype and parse_dates args"""
+    dtype, dates = {}, []
+    for col, t in (schema or {}).items():
+        if usecols is not None and col not in usecols:
+            continue
+        if t.startswith('datetime'):
+            dates.append(col)
+        elif t in ('object', 'str'):
+            dtype[col] = str
+        else:
+            dtype[col] = t
+    return (dtype or None), (dates or None)
+
+
+def metadata_path(fpath):
+    """
+    Returns the path of the metadata JSON written for a data file
+    :param fpath: pathlib.Path, data file, e.g. X_v1.0.0_abc1234.csv.gz
+    :return: pathlib.Path, e.g. X_v1.0.0_abc1234_metadata.json
+    """
+    name = fpath.name
+    if Path(name).suffix.lower() in CSV_COMPRESSION.values():
+        name = Path(name).stem
+    return fpath.parent / f'{Path(name).stem}_metadata.json'
+
+
+def _reader_ext(fpath):
+    """Returns the extension of fpath, ignoring a compression suffix"""
+    suffixes = [x.lower() for x in fpath.suffixes]
+    if len(suffixes) > 1 and suffixes[-1] in CSV_COMPRESSION.values():
+        return suffixes[-2]
+    return fpath.suffix.lower()
+
+
+def apply_filters(df, filters):
+    """
+    Subsets df to the rows matching filters given in pyarrow DNF form, for
+    readers that can not push filters down
+    :param df: pandas dataframe
+    :param filters: see read_into_df()
+    :return: filtered pandas dataframe
+    """
+    if not filters:
+        return df
+    if isinstance(filters[0], tuple):
+        filters = [filters]
+    ops = {'=': 'eq', '==': 'eq', '!=': 'ne', '<': 'lt', '<=': 'le',
+           '>': 'gt', '>=': 'ge'}
+    keep = pd.Series(False, index=df.index)
+    for conjunction in filters:
+        match = pd.Series(True, index=df.index)
+        for col, op, value in conjunction:
+            if op == 'in':
+                match &= df[col].isin(value)
+            elif op == 'not in':
+                match &= ~df[col].isin(value)
+            elif op in ops:
+                match &= getattr(df[col], ops[op])(value)
+            else:
+                raise ValueError(f'Unsupported filter operator {op}')
+        keep |= match
+    return df[keep].reset_index(drop=True)
+
+
+def _filter_terms(filters):
+    """Returns a flat list of the (column, op, value) tuples in filters"""
+    if isinstance(filters[0], tuple):
+        return list(filters)
+    return [term for conjunction in filters for term in conjunction]
+
+
 # def define_metafile(datafile,paths):
 #    data = strip_file_extension(datafile)
 #    metafile = paths.local_path / f'{data}_metadata.json'
@@ -261,8 +1654,10 @@ def write_metadata_to_file(paths, meta):
         fname = f'{fname}_{meta.git_hash}'
     fname = f'{fname}_metadata.json'
     file = folder / fname
+    before = _folder_mtime(folder)
     with file.open('w') as fi:
         fi.write(json.dumps(meta.__dict__, indent=4))
+    update_catalog(paths, [file], before)
 
 
 def read_source_metadata(paths, meta, force_JSON=False):
@@ -279,7 +1674,7 @@ def read_source_metadata(paths, meta, force_JSON=False):
         path = find_file(meta, paths)
     else:
         p = find_file(meta, paths)
-        path = p.parent / f'{p.stem}_metadata.json' if p else None
+        path = metadata_path(p) if p else None
     try:
         metadata = json.loads(path.read_text())
         return metadata
@@ -301,52 +1696,157 @@ def mkdir_if_missing(folder):
 def get_data_commons_index(file_meta, paths):
     """
     Returns a dataframe of files available on data commmons for the
-    particular category
+    particular category, listed through the storage backend of paths
     :param file_meta: instance of class FileMeta
     :param paths: instance of class Path
-    :param category: str of the category to search e.g. 'flowsa/FlowByActivity'
-    :return: dataframe with 'date' and 'file_name' as fields
+    :return: dataframe with 'date', 'file_name' and 'size' (bytes) as fields
     """
     subdir = file_meta.tool + '/'
     if file_meta.category != '':
         subdir = subdir + file_meta.category + '/'
 
-    s3 = boto3.Session().resource('s3')
-    s3.meta.client.meta.events.register('choose-signer.s3.*', disable_signing)
-
-    bucket = s3.Bucket('dmap-data-commons-ord')
-    d = {}
-    for item in bucket.objects.filter(Prefix=subdir):
-        d[item.key] = item.last_modified
-    df = pd.DataFrame.from_dict(d, orient='index').reset_index()
-
-    df.columns = ['file_name', 'last_modified']
+    df = get_backend(paths).list_objects(subdir)
     # Reformat the date to a pd datetime
-    df['date'] = pd.to_datetime(df['last_modified'],
-                                format='%Y-%m-%dT%H:%M:%S')
+    df['date'] = pd.to_datetime(df['date'], utc=True)
     # Remove the category name and trailing slash from the file name
     df['file_name'] = df['file_name'].str.replace(subdir, "")
     # Reset the index and return
-    df = df[['date', 'file_name']].reset_index(drop=True)
+    df = df[['date', 'file_name', 'size']].reset_index(drop=True)
     return df
 
 
 def parse_data_commons_index(df):
-    """Parse a df from data_commons_index into separate columns"""
-    df['ext'] = df['file_name'].str.rsplit('.', n=1, expand=True)[1]
-    df['file'] = df['file_name'].str.rsplit('.', n=1, expand=True)[0]
-    df['git_hash'] = df['file'].str.rsplit('_', n=1, expand=True)[1]
-    df['git_hash'] = df['git_hash'].fillna('')
-    df.loc[df['git_hash'].map(len) != 7, 'git_hash'] = ''
+    """
+    Parse a df from data_commons_index into separate columns, extracting
+    name, version, git_hash and ext in a single pass over file_name
+    """
+    parsed = df['file_name'].str.extract(FILE_NAME_PATTERN)
+    parsed['name'] = parsed['name'].fillna(df['file_name'])
+    df = pd.concat([parsed[['name', 'version', 'git_hash', 'ext']]
+                    .fillna('').astype(str),
+                    df[[c for c in ('date', 'file_name', 'size')
+                        if c in df.columns]]], axis=1)
+    return df.reset_index(drop=True)
+
+
+def version_rank(versions):
+    """
+    Ranks version strings in numeric order, e.g. '1.10.0' above '1.9.0'.
+    Only the distinct versions are compared in Python.
+    :param versions: pd.Series of str
+    :return: pd.Series of int, higher for more recent versions
+    """
+    order = sorted(versions.unique(), key=version_key)
+    return versions.map({v: i for i, v in enumerate(order)})
+
+
+# in-process copies of local file catalogs, keyed by catalog path
+_catalogs = {}
+
+# markers of folders registered by _register_folder() in this process
+_registered = set()
+
+# in-process copies of parsed indices, keyed by the cache file path and
+# holding (mtime of the cache file, parsed index dataframe)
+_index_memo = {}
+
+
+def index_cache_path(file_meta, paths):
+    """
+    Returns the local path of the cached data commons index for the tool
+    and category of file_meta. The name carries a hash of the repr of the
+    storage backend of paths, so that switching remotes does not reuse the
+    index listed from another one.
+    :param file_meta: instance of class FileMeta
+    :param paths: instance of class Paths
+    :return: pathlib.Path
+    """
+    name = file_meta.tool
+    if file_meta.category != '':
+        name = f'{name}_{file_meta.category}'
+    remote = hashlib.sha256(repr(get_backend(paths)).encode()).hexdigest()
+    return (paths.local_path / '.index'
+            / f'{name.replace("/", "_")}_{remote[:12]}.parquet')
+
+
+def index_is_fresh(file_meta, paths, ttl=None):
+    """
+    Checks, without contacting the remote, whether a cached index exists for
+    the tool and category of file_meta and is younger than ttl
+    :param file_meta: instance of class FileMeta
+    :param paths: instance of class Paths
+    :param ttl: int, seconds; defaults to paths.index_ttl
+    :return: bool
+    """
+    ttl = paths.index_ttl if ttl is None else ttl
+    try:
+        mtime = index_cache_path(file_meta, paths).stat().st_mtime
+    except FileNotFoundError:
+        return False
+    return time.time() - mtime < ttl
+
+
+def load_data_commons_index(file_meta, paths, ttl=None, force_refresh=False):
+    """
+    Returns the parsed data commons index for the tool and category of
+    file_meta. The index is read from the local cache when it is younger than
+    ttl, otherwise it is fetched from the remote and the cache is rewritten.
+    If the remote can not be reached, a stale cache is used when available.
+    :param file_meta: instance of class FileMeta
+    :param paths: instance of class Paths
+    :param ttl: int, seconds; defaults to paths.index_ttl
+    :param force_refresh: bool, True to always fetch the index from remote
+    :return: dataframe as returned by parse_data_commons_index
+    """
+    cache = index_cache_path(file_meta, paths)
+    if not force_refresh and index_is_fresh(file_meta, paths, ttl):
+        df = _read_index_cache(cache)
+        if df is not None:
+            return df.copy()
+    try:
+        df = get_data_commons_index(file_meta, paths)
+    except Exception as e:
+        df = _read_index_cache(cache)
+        if df is None:
+            raise e
+        log.warning(f'Unable to refresh data commons index, using cached '
+                    f'index from {cache}')
+        return df.copy()
+    if df is None:
+        return None
+    df = parse_data_commons_index(df)
+    _write_index_cache(df, cache)
+    return df.copy()
+
+
+def _read_index_cache(cache):
+    """Returns the cached index at path cache, or None if unavailable"""
+    try:
+        mtime = cache.stat().st_mtime
+    except FileNotFoundError:
+        return None
+    memo = _index_memo.get(cache)
+    if memo is not None and memo[0] == mtime:
+        return memo[1]
     try:
-        df['version'] = (df['file']
-                         .str.split('_v', n=1, expand=True)[1]
-                         .str.split('_', expand=True)[0])
-        df['name'] = df['file'].str.split('_v', n=1, expand=True)[0]
-    except KeyError:
-        df['version'] = ''
-        df['name'] = df['file']
-    df = df[['name', 'version', 'git_hash',
-             'ext', 'date', 'file_name']].reset_index(drop=True)
-    df.fillna('', inplace=True)
+        df = pd.read_parquet(cache)
+    except Exception:
+        log.debug(f'Unable to read cached index {cache}')
+        return None
+    _index_memo[cache] = (mtime, df)
     return df
+
+
+def _write_index_cache(df, cache):
+    """Atomically writes the parsed index df to path cache"""
+    mkdir_if_missing(cache.parent)
+    fd, tmp = tempfile.mkstemp(dir=cache.parent, prefix='.', suffix='.tmp')
+    os.close(fd)
+    try:
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, cache)
+    except Exception:
+        log.debug(f'Unable to cache index at {cache}')
+        Path(tmp).unlink(missing_ok=True)
+        return
+    _index_memo[cache] = (cache.stat().st_mtime, df.copy())
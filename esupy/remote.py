@@ -4,55 +4,641 @@
 """
 Functions for handling remote requests and parsing
 """
+import asyncio
+import hashlib
+import http.cookiejar
+import json
 import logging as log
+import os
+import pandas as pd
+import random
 import requests
+import shutil
+import tempfile
+import threading
 import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from functools import partial
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from urllib.parse import urlparse
+
+from esupy.http_cache import ResponseCache
+from esupy.util import FileLock
 
 
 headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"}
 # ^^ HTTP 403 Error may require specifying header
 
+# responses worth retrying after a pause
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class HttpClient:
+    """
+    HTTP client shared by all esupy network calls. Connections are kept
+    alive in a pool per host, at most max_per_host requests run against one
+    host at a time, failed requests are retried with exponential backoff
+    and jitter (honoring Retry-After), and counters of requests, bytes,
+    retries and latency are kept for the whole process. The shared session
+    rejects all cookies, so that no request sees cookies set for another;
+    requests that need cookies use session_with_own_cookies().
+    """
+    def __init__(self, pool_size=16, max_per_host=8, backoff=1.0,
+                 max_backoff=60.0):
+        """
+        :param pool_size: int, max connections kept alive per host
+        :param max_per_host: int, max concurrent requests to one host
+        :param backoff: float, seconds of the first retry delay, doubled on
+            each further attempt
+        :param max_backoff: float, cap on a single retry delay in seconds
+        """
+        self.session = make_session(pool_size)
+        self.session.cookies.set_policy(
+            http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+        self.max_per_host = max_per_host
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._hosts = {}
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def request(self, method, url, *, session=None, max_attempts=3,
+                **kwargs):
+        """
+        Sends a request, retrying connection errors and responses in
+        RETRY_STATUS. The last response is returned as is, so the caller
+        decides whether to raise_for_status().
+        :param method: str, e.g. 'GET'
+        :param url: URL to query
+        :param session: requests.Session to send through, defaults to the
+            client's pooled session
+        :param max_attempts: int number of attempts
+        :param kwargs: pass-through to requests.Session().request()
+        :return: requests.Response
+        """
+        s = session if session is not None else self.session
+        for attempt in range(max_attempts):
+            start = time.perf_counter()
+            try:
+                response = self._send(s, method, url, **kwargs)
+            except requests.exceptions.RequestException as err:
+                self._count(time.perf_counter() - start)
+                if attempt < max_attempts - 1:
+                    log.debug(err)
+                    self.wait(attempt)
+                    continue
+                raise
+            self._count(time.perf_counter() - start)
+            if (response.status_code in RETRY_STATUS
+                    and attempt < max_attempts - 1):
+                log.debug(f'{url} returned {response.status_code}, retrying')
+                response.close()
+                self.wait(attempt, response.headers.get('Retry-After'))
+                continue
+            return response
+
+    def session_with_own_cookies(self):
+        """
+        Returns a new requests.Session with an empty cookie jar that sends
+        through the client's connection pools. The adapters are shared, so
+        the session must not be closed.
+        """
+        s = requests.Session()
+        s.mount('https://', self.session.get_adapter('https://'))
+        s.mount('http://', self.session.get_adapter('http://'))
+        return s
+
+    def wait(self, attempt, retry_after=None):
+        """
+        Sleeps before retry number attempt + 1, for a random time up to
+        backoff * 2 ** attempt, or as long as the server asked in a
+        Retry-After header, capped at max_backoff
+        """
+        delay = random.uniform(0, self.backoff * 2 ** attempt)
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    delay = (parsedate_to_datetime(retry_after)
+                             - datetime.now(timezone.utc)).total_seconds()
+                except (TypeError, ValueError):
+                    pass
+        with self._lock:
+            self._stats['retries'] += 1
+        time.sleep(max(0.0, min(delay, self.max_backoff)))
+
+    def add_bytes(self, n):
+        """Counts n bytes of response body received"""
+        with self._lock:
+            self._stats['bytes'] += n
+
+    def stats(self):
+        """
+        :return: dict of 'requests', 'bytes', 'retries' and total and mean
+            'latency' in seconds, counted since the last reset_stats()
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats['mean_latency'] = (stats['latency'] / stats['requests']
+                                 if stats['requests'] else 0.0)
+        return stats
+
+    def reset_stats(self):
+        self._stats = {'requests': 0, 'bytes': 0, 'retries': 0,
+                       'latency': 0.0}
+
+    def _count(self, latency):
+        with self._lock:
+            self._stats['requests'] += 1
+            self._stats['latency'] += latency
+
+    def _send(self, session, method, url, **kwargs):
+        """
+        Sends one request holding a slot of the host of url. The slot of a
+        streamed response is held until the response is closed, so that
+        bodies being read count against max_per_host.
+        """
+        slot = self._host_slot(url)
+        slot.acquire()
+        try:
+            response = session.request(method, url, **kwargs)
+            if not kwargs.get('stream'):
+                self.add_bytes(len(response.content))
+        except BaseException:
+            slot.release()
+            raise
+        if not kwargs.get('stream'):
+            slot.release()
+            return response
+        # runs once, on close() or when a response left open is collected
+        release = weakref.finalize(response, slot.release)
+        close = response.close
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                release()
+        response.close = close_and_release
+        return response
+
+    def _host_slot(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(
+                    self.max_per_host)
+            return self._hosts[host]
+
+
 def make_url_request(url, *, method='GET',
                      set_cookies=False, confirm_gdrive=False,
-                     max_attempts=3, **kwargs):
+                     max_attempts=3, session=None, cache=None, max_age=None,
+                     **kwargs):
     """
-    Makes http request using requests library
+    Makes http request through the shared client
     :param url: URL to query
     :param set_cookies:
     :param confirm_gdrive:
     :param max_attempts: int number of retries allowed in query
+    :param session: requests.Session to reuse, e.g. from make_session();
+        if None the pooled session of the shared client is used
+    :param cache: ResponseCache to answer GET requests from, or True for
+        the shared http_cache; None to always request from the network
+    :param max_age: float, seconds a cached response is used before it is
+        revalidated with the server; None to use it until evicted
     :param kwargs: pass-through to requests.Session().get()
     :return: request Object
     """
-    with requests.Session() as s:
-        for attempt in range(max_attempts):
+    if cache and method == 'GET':
+        store = http_cache if cache is True else cache
+        entry = _cached_entry(url, store, max_age, set_cookies=set_cookies,
+                              confirm_gdrive=confirm_gdrive,
+                              max_attempts=max_attempts, session=session,
+                              **kwargs)
+        return store.response(entry)
+    if session is not None:
+        context = nullcontext(session)
+    elif set_cookies or confirm_gdrive:
+        # keep cookies of this exchange out of the shared session
+        context = nullcontext(client.session_with_own_cookies())
+    else:
+        context = nullcontext(client.session)
+    try:
+        with context as s:
+            # The session object s preserves cookies, so the second request
+            # will have the cookies that came from the first request
+            response = client.request(method, url, session=s,
+                                      max_attempts=max_attempts, **kwargs)
+            if set_cookies:
+                response.close()
+                response = client.request(method, url, session=s,
+                                          max_attempts=max_attempts)
+            if confirm_gdrive:
+                response.close()
+                response = client.request(method, url, session=s,
+                                          max_attempts=max_attempts,
+                                          params={'confirm': 't'})
             try:
-                # The session object s preserves cookies, so the second s.get()
-                # will have the cookies that came from the first s.get()
-                response = s.request(method, url, **kwargs)
-                if set_cookies:
-                    response = s.request(method, url)
-                if confirm_gdrive:
-                    response = s.request(method, url, params={'confirm': 't'})
                 response.raise_for_status()
-                break
             except requests.exceptions.HTTPError as err:
+                if response.status_code != 403:
+                    raise
                 # ^^ HTTP 403 Error may require specifying header
                 log.debug(err)
-                response = s.request(method, url, headers=headers)
+                response.close()
+                client.wait(0)
+                response = client.request(
+                    method, url, session=s, max_attempts=max_attempts,
+                    **{**kwargs, 'headers': {**kwargs.get('headers', {}),
+                                             **headers}})
                 response.raise_for_status()
-                break
-            except requests.exceptions.RequestException as err:
-                if attempt < max_attempts - 1:
-                    log.debug(err)
-                    time.sleep(5)
-                    continue
-                else:
-                    log.exception(err)
-                    raise
+    except requests.exceptions.HTTPError as err:
+        if kwargs.get('stream') and err.response is not None:
+            # free the connection and host slot of the unread body
+            err.response.close()
+        raise
+    except requests.exceptions.RequestException as err:
+        log.exception(err)
+        raise
     return response
 
 
+def cached_file(url, *, cache=True, max_age=None, segments=4):
+    """
+    Returns the path of the cached body of url, fetching it into the cache
+    when missing or stale, e.g. for readers that need a file such as
+    zipped shapefiles. The body is downloaded with download_segmented(), so
+    large files are fetched as parallel ranges and an interrupted download
+    resumes on the next call. The file must not be modified.
+    :param url: URL to query
+    :param cache: ResponseCache, or True for the shared http_cache
+    :param max_age: float, seconds before the cached body is revalidated;
+        None to use it until evicted
+    :param segments: int, max number of ranges fetched at once
+    :return: pathlib.Path
+    """
+    store = http_cache if cache is True else cache
+    entry, fresh = _cache_lookup(url, store, max_age)
+    if fresh:
+        return store.blob(entry)
+    # stable name per url, so that partial ranges of an earlier attempt
+    # are found again
+    key = hashlib.sha256(url.encode()).hexdigest()[:16]
+    part = store.root / 'downloads' / f'{key}{Path(urlparse(url).path).suffix}'
+    started = time.time()
+    with FileLock(part) as lock:
+        if lock.waited:
+            # another process may have just fetched url
+            entry, _ = _cache_lookup(url, store, max_age)
+            if entry is not None and entry['stored'] >= started:
+                return store.blob(entry)
+        r = download_segmented(url, part, segments=segments,
+                               validators=_entry_validators(entry))
+        if r.status_code == 304 and entry is not None:
+            return store.blob(store.refresh(entry))
+        return store.blob(store.store_file(url, part, r.headers))
+
+
+def _cached_entry(url, store, max_age, **kwargs):
+    """
+    Returns the cache entry of a GET of url, reusing a fresh entry without
+    contacting the server, revalidating a stale one and storing the
+    response otherwise
+    """
+    kwargs.pop('stream', None)
+    full_url = requests.Request('GET', url,
+                                params=kwargs.get('params')).prepare().url
+    entry, fresh = _cache_lookup(full_url, store, max_age)
+    if fresh:
+        return entry
+    if entry is not None:
+        kwargs['headers'] = {**kwargs.get('headers', {}),
+                             **conditional_headers(_entry_validators(entry))}
+    response = make_url_request(url, stream=True, **kwargs)
+    if response.status_code == 304 and entry is not None:
+        response.close()
+        return store.refresh(entry)
+    return store.store(full_url, response)
+
+
+def _cache_lookup(url, store, max_age):
+    """
+    Returns the cache entry of url, None if url is not cached, and whether
+    the entry can be used without contacting the server
+    """
+    entry = store.entry(url)
+    if entry is not None:
+        return entry, store.offline or store.is_fresh(entry, max_age)
+    if store.offline:
+        raise requests.exceptions.ConnectionError(
+            f'{url} is not cached and the cache is offline')
+    return None, False
+
+
+def _entry_validators(entry):
+    """Validators of a cache entry in the form of response_validators()"""
+    if entry is None:
+        return None
+    return {'etag': entry['headers'].get('ETag'),
+            'last_modified': entry['headers'].get('Last-Modified')}
+
+
+async def fetch_many_async(urls, *, max_concurrency=8, **kwargs):
+    """
+    Requests many URLs concurrently with make_url_request(), at most
+    max_concurrency at a time, for use from async code
+    :param urls: list of URLs to query
+    :param max_concurrency: int, max requests in flight at once
+    :param kwargs: pass-through to make_url_request(), e.g. set_cookies,
+        confirm_gdrive or params
+    :return: list in the order of urls, holding the requests.Response of
+        each URL or the exception raised when requesting it
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    try:
+        return await asyncio.gather(
+            *(loop.run_in_executor(executor,
+                                   partial(make_url_request, url, **kwargs))
+              for url in urls),
+            return_exceptions=True)
+    finally:
+        executor.shutdown(wait=False)
+
+
+def fetch_many(urls, *, max_concurrency=8, **kwargs):
+    """
+    Requests many URLs concurrently, see fetch_many_async(). Callable from
+    synchronous code, including while an event loop is running, e.g. in a
+    notebook.
+    :param urls: list of URLs to query
+    :param max_concurrency: int, max requests in flight at once
+    :param kwargs: pass-through to make_url_request()
+    :return: list in the order of urls, holding the requests.Response of
+        each URL or the exception raised when requesting it
+    """
+    coro = fetch_many_async(urls, max_concurrency=max_concurrency, **kwargs)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    # asyncio.run() can not be nested, so run in a thread of its own
+    with ThreadPoolExecutor(max_workers=1) as runner:
+        return runner.submit(asyncio.run, coro).result()
+
+
+def make_session(pool_size=10):
+    """
+    Returns a requests.Session whose connection pool can hold pool_size
+    connections per host, for sharing across threads
+    :param pool_size: int, max connections kept alive per host
+    :return: requests.Session
+    """
+    s = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                            pool_maxsize=pool_size)
+    s.mount('https://', adapter)
+    s.mount('http://', adapter)
+    return s
+
+
+# client through which esupy sends all http requests
+client = HttpClient()
+
+# cache of responses in the local data store, used with cache=True
+http_cache = ResponseCache()
+
+
+def conditional_headers(validators):
+    """
+    Builds request headers that make a server answer 304 Not Modified when
+    the remote object still matches previously recorded validators
+    :param validators: dict with optional 'etag' and 'last_modified' keys,
+        as returned by response_validators()
+    :return: dict of headers
+    """
+    h = {}
+    if validators:
+        if validators.get('etag'):
+            h['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            h['If-Modified-Since'] = validators['last_modified']
+    return h
+
+
+def response_validators(response):
+    """
+    Extracts the validators of a response for later conditional requests
+    :param response: requests.Response
+    :return: dict with 'etag', 'last_modified' and 'size' keys
+    """
+    size = response.headers.get('Content-Length')
+    return {'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'size': int(size) if size is not None else None}
+
+
+def download_file(url, file, *, session=None, chunk_size=1024 * 1024,
+                  verify_size=True, verify_checksum=False, validators=None,
+                  **kwargs):
+    """
+    Streams the body of url in chunks to a temporary file next to file, then
+    atomically renames it into place so that an interrupted download never
+    leaves a partial file at the target path.
+    :param url: URL to download
+    :param file: pathlib.Path, destination file
+    :param session: requests.Session to reuse, optional
+    :param chunk_size: int, bytes held in memory at once
+    :param verify_size: bool, compare bytes received to Content-Length
+    :param verify_checksum: bool, compare the MD5 of the bytes received to
+        the ETag, when the ETag is a plain MD5 digest as for S3 objects
+        uploaded in a single part
+    :param validators: dict of recorded validators of the local copy; if the
+        remote is unchanged, file is left as is and the returned response
+        has status_code 304
+    :param kwargs: pass-through to make_url_request()
+    :return: requests.Response, with the body already consumed
+    """
+    file = Path(file)
+    file.parent.mkdir(parents=True, exist_ok=True)
+    if validators:
+        kwargs['headers'] = {**kwargs.get('headers', {}),
+                             **conditional_headers(validators)}
+    r = make_url_request(url, session=session, stream=True, **kwargs)
+    if r.status_code == 304:
+        r.close()
+        return r
+    fd, tmp = tempfile.mkstemp(dir=file.parent, prefix=f'.{file.name}.',
+                               suffix='.part')
+    try:
+        md5 = hashlib.md5()
+        size = 0
+        with r, os.fdopen(fd, 'wb') as fi:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                fi.write(chunk)
+                md5.update(chunk)
+                size += len(chunk)
+        client.add_bytes(size)
+        expected = r.headers.get('Content-Length')
+        if (verify_size and expected is not None
+                and 'Content-Encoding' not in r.headers
+                and int(expected) != size):
+            raise IOError(f'{url} returned {size} of {expected} bytes')
+        etag = r.headers.get('ETag', '').strip('"')
+        if (verify_checksum and len(etag) == 32 and '-' not in etag
+                and etag != md5.hexdigest()):
+            raise IOError(f'{url} failed checksum: MD5 {md5.hexdigest()} '
+                          f'does not match ETag {etag}')
+        os.replace(tmp, file)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    return r
+
+
+def download_segmented(url, file, *, segments=4,
+                       min_segment_size=8 * 1024 * 1024, session=None,
+                       chunk_size=1024 * 1024, verify_checksum=False,
+                       validators=None):
+    """
+    Downloads url to file as byte ranges fetched in parallel, then joins the
+    ranges into file. Completed bytes of each range are kept in a hidden
+    folder next to file, so that calling again after an interruption resumes
+    where it stopped, provided the remote object is unchanged. Falls back to
+    download_file() when the server does not support Range requests, refuses
+    the HEAD request, or the object is too small to split.
+    :param url: URL to download
+    :param file: pathlib.Path, destination file
+    :param segments: int, max number of ranges fetched at once
+    :param min_segment_size: int, smallest range in bytes worth splitting off
+    :param session: requests.Session to reuse, defaults to the pooled
+        session of the shared client
+    :param chunk_size: int, bytes held in memory at once per range
+    :param verify_checksum: bool, compare the MD5 of the joined file to the
+        ETag, when the ETag is a plain MD5 digest
+    :param validators: dict of recorded validators of the local copy; if the
+        remote is unchanged, file is left as is and the returned response
+        has status_code 304
+    :return: requests.Response, headers describing the remote object
+    """
+    file = Path(file)
+    with nullcontext(session if session is not None
+                     else client.session) as s:
+        try:
+            head = make_url_request(url, method='HEAD', session=s,
+                                    allow_redirects=True,
+                                    headers=conditional_headers(validators))
+        except requests.exceptions.RequestException as err:
+            log.debug(f'HEAD {url} failed, downloading as a single stream: '
+                      f'{err}')
+            return download_file(url, file, session=s,
+                                 verify_checksum=verify_checksum,
+                                 validators=validators)
+        if head.status_code == 304:
+            return head
+        size = int(head.headers.get('Content-Length', 0))
+        validator = (head.headers.get('ETag') or
+                     head.headers.get('Last-Modified'))
+        n = min(segments, size // max(min_segment_size, 1))
+        if (head.headers.get('Accept-Ranges', '').lower() != 'bytes'
+                or 'Content-Encoding' in head.headers or n < 2):
+            return download_file(url, file, session=s,
+                                 verify_checksum=verify_checksum)
+        step = -(-size // n)
+        ranges = [(start, min(start + step, size) - 1)
+                  for start in range(0, size, step)]
+        part_dir = _segment_dir(file, {'url': url, 'size': size,
+                                       'validator': validator,
+                                       'ranges': ranges})
+        try:
+            with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                list(executor.map(
+                    lambda i: _fetch_range(s, url, part_dir / str(i),
+                                           *ranges[i], validator,
+                                           chunk_size),
+                    range(len(ranges))))
+        except _RangeIgnored:
+            log.info(f'{url} changed or ignored Range, downloading as a '
+                     f'single stream')
+            shutil.rmtree(part_dir, ignore_errors=True)
+            return download_file(url, file, session=s,
+                                 verify_checksum=verify_checksum)
+    fd, tmp = tempfile.mkstemp(dir=file.parent, prefix=f'.{file.name}.',
+                               suffix='.part')
+    try:
+        md5 = hashlib.md5()
+        with os.fdopen(fd, 'wb') as fi:
+            for i in range(len(ranges)):
+                with (part_dir / str(i)).open('rb') as seg:
+                    for chunk in iter(lambda: seg.read(chunk_size), b''):
+                        fi.write(chunk)
+                        md5.update(chunk)
+        if Path(tmp).stat().st_size != size:
+            raise IOError(f'{url} joined to {Path(tmp).stat().st_size} '
+                          f'of {size} bytes')
+        etag = (validator or '').strip('"')
+        if (verify_checksum and len(etag) == 32 and '-' not in etag
+                and etag != md5.hexdigest()):
+            raise IOError(f'{url} failed checksum: MD5 {md5.hexdigest()} '
+                          f'does not match ETag {etag}')
+        os.replace(tmp, file)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    shutil.rmtree(part_dir, ignore_errors=True)
+    return head
+
+
+class _RangeIgnored(Exception):
+    """Server answered a Range request with the full object"""
+
+
+def _segment_dir(file, state):
+    """
+    Returns the folder holding partial ranges of file, clearing it first if
+    it was created for a different url, size, validator or split
+    """
+    part_dir = file.parent / f'.{file.name}.segments'
+    state_file = part_dir / 'state.json'
+    try:
+        if json.loads(state_file.read_text()) != json.loads(
+                json.dumps(state)):
+            shutil.rmtree(part_dir)
+    except (FileNotFoundError, ValueError):
+        shutil.rmtree(part_dir, ignore_errors=True)
+    if not part_dir.exists():
+        part_dir.mkdir(parents=True)
+        state_file.write_text(json.dumps(state))
+    return part_dir
+
+
+def _fetch_range(s, url, seg, start, end, validator, chunk_size):
+    """Appends bytes start..end of url to seg, skipping bytes present"""
+    have = seg.stat().st_size if seg.exists() else 0
+    if start + have > end:
+        return
+    range_headers = {'Range': f'bytes={start + have}-{end}'}
+    if validator:
+        range_headers['If-Range'] = validator
+    with client.request('GET', url, session=s, headers=range_headers,
+                        stream=True) as r:
+        r.raise_for_status()
+        if r.status_code != 206:
+            raise _RangeIgnored(url)
+        with seg.open('ab') as fi:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                fi.write(chunk)
+                client.add_bytes(len(chunk))
+    if seg.stat().st_size != end - start + 1:
+        raise IOError(f'Incomplete range {start}-{end} of {url}')
+
+
 # Alias for backward compatibility
 def make_http_request(url):
     log.warning('esupy.remote.make_http_request() has been renamed to '
@@ -62,22 +648,69 @@ def make_http_request(url):
     return make_url_request(url)
 
 
-def url_is_alive(url):
-    """Check that a given URL is reachable.
+def url_is_alive(url, timeout=30):
+    """Check that a given URL is reachable, without downloading its body.
 
     :param url: A URL
+    :param timeout: float, seconds to wait for the server
     :rtype: bool
     """
-    with requests.Session() as s:
-        try:
-            response = s.get(url, headers=headers)
-            response.raise_for_status()
-            return True
-        except requests.exceptions.HTTPError as err:
-            print(err)
-            return False
-        except requests.exceptions.RequestException as err:
-            print(err)
-            return False
-        else:
-            return False
+    result = check_url(url, timeout=timeout)
+    if not result['ok']:
+        print(result['error'] or f'{result["status"]} for url: {url}')
+    return result['ok']
+
+
+def check_urls(urls, max_workers=16, timeout=10):
+    """
+    Checks many URLs concurrently for reachability, without downloading
+    their bodies, e.g. to validate all configured sources before a long run
+    :param urls: list of URLs
+    :param max_workers: int, max URLs checked at once
+    :param timeout: float, seconds to wait for each server
+    :return: pd.DataFrame with one row per URL, in the order of urls, and
+        columns 'url', 'status', 'ok', 'latency' (seconds),
+        'content_length', 'last_modified', 'method' and 'error'
+    """
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        results = list(executor.map(partial(check_url, timeout=timeout),
+                                    urls))
+    return pd.DataFrame(results, columns=[
+        'url', 'status', 'ok', 'latency', 'content_length', 'last_modified',
+        'method', 'error'])
+
+
+def check_url(url, timeout=10):
+    """
+    Checks a URL with a HEAD request, falling back to a GET of its first
+    byte for servers that do not answer HEAD properly
+    :param url: URL to check
+    :param timeout: float, seconds to wait for the server
+    :return: dict with the fields of a check_urls() row
+    """
+    result = {'url': url, 'status': None, 'ok': False, 'latency': None,
+              'content_length': None, 'last_modified': None,
+              'method': 'HEAD', 'error': None}
+    start = time.perf_counter()
+    try:
+        r = client.request('HEAD', url, headers=headers, timeout=timeout,
+                           allow_redirects=True, max_attempts=1)
+        r.close()
+        size = r.headers.get('Content-Length')
+        if not r.ok:
+            result['method'] = 'GET'
+            r = client.request('GET', url, timeout=timeout, stream=True,
+                               allow_redirects=True, max_attempts=1,
+                               headers={**headers, 'Range': 'bytes=0-0'})
+            r.close()
+            size = r.headers.get('Content-Length')
+            if r.status_code == 206:
+                size = r.headers.get('Content-Range', '').rpartition('/')[2]
+        result.update(status=r.status_code, ok=r.ok,
+                      last_modified=r.headers.get('Last-Modified'),
+                      content_length=int(size) if size and size.isdigit()
+                      else None)
+    except requests.exceptions.RequestException as err:
+        result['error'] = str(err)
+    result['latency'] = time.perf_counter() - start
+    return result
@@ -0,0 +1,290 @@
+# storage.py (esupy)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+Storage backends from which preprocessed data are listed and fetched: the
+public data commons bucket, any S3-compatible endpoint, or a local directory
+"""
+import os
+import shutil
+import tempfile
+import threading
+import xml.etree.ElementTree as ET
+from email.utils import formatdate
+from pathlib import Path
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+import boto3
+import pandas as pd
+import requests
+from botocore.exceptions import ClientError
+from botocore.handlers import disable_signing
+
+from esupy.remote import download_file, download_segmented, make_url_request
+
+DATA_COMMONS_BUCKET = 'dmap-data-commons-ord'
+S3_XMLNS = {'s3': 'http://s3.amazonaws.com/doc/2006-03-01/'}
+
+
+class S3Backend:
+    """
+    Objects in a bucket of any S3-compatible store, e.g. MinIO, listed and
+    fetched with boto3
+    """
+    def __init__(self, bucket, endpoint_url=None, anonymous=False,
+                 **client_kwargs):
+        """
+        :param bucket: str, bucket name
+        :param endpoint_url: str, e.g. 'http://minio.local:9000'; None for
+            AWS
+        :param anonymous: bool, send unsigned requests to a public bucket
+        :param client_kwargs: pass-through to boto3 client(), e.g.
+            aws_access_key_id, region_name
+        """
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.anonymous = anonymous
+        self.client_kwargs = client_kwargs
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    def __repr__(self):
+        return (f'{type(self).__name__}({self.bucket!r}, '
+                f'endpoint_url={self.endpoint_url!r})')
+
+    def client(self):
+        """
+        Returns the boto3 client of this backend, created on first use and
+        shared by all threads afterwards
+        """
+        with self._client_lock:
+            if self._client is None:
+                s3 = boto3.Session().client(
+                    's3', endpoint_url=self.endpoint_url,
+                    **self.client_kwargs)
+                if self.anonymous:
+                    s3.meta.events.register('choose-signer.s3.*',
+                                            disable_signing)
+                self._client = s3
+            return self._client
+
+    def list_objects(self, prefix):
+        """
+        Lists objects whose key starts with prefix
+        :param prefix: str, e.g. 'flowsa/FlowByActivity/'
+        :return: dataframe with 'file_name' (full key), 'date' and 'size'
+        """
+        paginator = self.client().get_paginator('list_objects_v2')
+        rows = [(item['Key'], item['LastModified'], item['Size'])
+                for page in paginator.paginate(Bucket=self.bucket,
+                                               Prefix=prefix)
+                for item in page.get('Contents', [])]
+        return _listing(rows)
+
+    def fetch(self, key, file, *, session=None, validators=None,
+              verify_checksum=False, segments=1):
+        """
+        Streams object key to the local path file, replacing it atomically
+        :param key: str, object key
+        :param file: pathlib.Path, destination
+        :param session: unused, for a common signature with other backends
+        :param validators: dict of recorded validators of the local copy; if
+            the object is unchanged the returned response has status 304
+        :param verify_checksum: unused, S3 verifies transfers itself
+        :param segments: unused, boto3 manages transfer concurrency
+        :return: requests.Response with status_code and object headers
+        """
+        kwargs = {}
+        if validators and validators.get('etag'):
+            kwargs['IfNoneMatch'] = validators['etag']
+        try:
+            obj = self.client().get_object(Bucket=self.bucket, Key=key,
+                                           **kwargs)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('304',
+                                                           'NotModified'):
+                return _response(304, {})
+            raise
+        file.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=file.parent, prefix=f'.{file.name}.',
+                                   suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as fi:
+                for chunk in obj['Body'].iter_chunks(1024 * 1024):
+                    fi.write(chunk)
+            os.replace(tmp, file)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        return _response(200, {
+            'ETag': obj.get('ETag'),
+            'Last-Modified': formatdate(
+                obj['LastModified'].timestamp(), usegmt=True),
+            'Content-Length': str(obj.get('ContentLength'))})
+
+
+class DataCommonsBackend(S3Backend):
+    """
+    The public data commons bucket, or a public mirror of it: fetched over
+    HTTPS, with resumable segmented downloads when requested, and listed
+    anonymously with boto3 when the bucket is known, otherwise with the S3
+    ListObjectsV2 call over plain HTTP at public_url
+    """
+    def __init__(self, public_url=f'https://{DATA_COMMONS_BUCKET}'
+                                  f'.s3.amazonaws.com/',
+                 bucket=DATA_COMMONS_BUCKET):
+        """
+        :param public_url: str, URL the object keys are appended to
+        :param bucket: str, AWS bucket served at public_url; None for a
+            mirror on another S3-compatible server
+        """
+        super().__init__(bucket, anonymous=True)
+        self.public_url = public_url
+
+    def __repr__(self):
+        return (f'{type(self).__name__}({self.public_url!r}, '
+                f'bucket={self.bucket!r})')
+
+    def list_objects(self, prefix):
+        if self.bucket is not None:
+            return super().list_objects(prefix)
+        rows = []
+        params = {'list-type': 2, 'prefix': prefix}
+        while True:
+            root = ET.fromstring(
+                make_url_request(self.public_url, params=params).content)
+            for item in root.iterfind('s3:Contents', S3_XMLNS):
+                rows.append((item.findtext('s3:Key', namespaces=S3_XMLNS),
+                             pd.Timestamp(item.findtext(
+                                 's3:LastModified', namespaces=S3_XMLNS)),
+                             int(item.findtext('s3:Size',
+                                               namespaces=S3_XMLNS))))
+            token = root.findtext('s3:NextContinuationToken',
+                                  namespaces=S3_XMLNS)
+            if root.findtext('s3:IsTruncated',
+                             namespaces=S3_XMLNS) != 'true' or not token:
+                break
+            params['continuation-token'] = token
+        return _listing(rows)
+
+    def fetch(self, key, file, *, session=None, validators=None,
+              verify_checksum=False, segments=1):
+        url = self.public_url + key
+        if segments > 1:
+            return download_segmented(url, file, segments=segments,
+                                      session=session, validators=validators,
+                                      verify_checksum=verify_checksum)
+        return download_file(url, file, session=session,
+                             validators=validators,
+                             verify_checksum=verify_checksum)
+
+
+class FilesystemBackend:
+    """
+    A plain directory mirroring the data commons layout
+    (root/{tool}/{category}/{file}), e.g. on a shared drive, for air-gapped
+    runs and tests without network access
+    """
+    def __init__(self, root):
+        """
+        :param root: str or pathlib.Path, mirror directory
+        """
+        self.root = Path(root)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({str(self.root)!r})'
+
+    def list_objects(self, prefix):
+        """
+        Lists files whose path relative to root starts with prefix
+        :param prefix: str, e.g. 'flowsa/FlowByActivity/'
+        :return: dataframe with 'file_name' (full key), 'date' and 'size'
+        """
+        base = self.root / prefix
+        rows = []
+        if base.is_dir():
+            for dirpath, dirnames, filenames in os.walk(base):
+                dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+                for f in filenames:
+                    if f.startswith('.'):
+                        continue
+                    p = Path(dirpath) / f
+                    st = p.stat()
+                    rows.append((p.relative_to(self.root).as_posix(),
+                                 pd.Timestamp(st.st_mtime, unit='s',
+                                              tz='UTC'),
+                                 st.st_size))
+        return _listing(rows)
+
+    def fetch(self, key, file, *, session=None, validators=None,
+              verify_checksum=False, segments=1):
+        """
+        Copies key to the local path file, replacing it atomically
+        :param key: str, path relative to root
+        :param file: pathlib.Path, destination
+        :param validators: dict of recorded validators of the local copy; if
+            the source is unchanged the returned response has status 304
+        :return: requests.Response with status_code and file headers
+        """
+        src = self.root / key
+        st = src.stat()
+        headers = {'ETag': f'"{st.st_mtime_ns:x}-{st.st_size:x}"',
+                   'Last-Modified': formatdate(st.st_mtime, usegmt=True),
+                   'Content-Length': str(st.st_size)}
+        if validators and validators.get('etag') == headers['ETag']:
+            return _response(304, headers)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=file.parent, prefix=f'.{file.name}.',
+                                   suffix='.part')
+        os.close(fd)
+        try:
+            shutil.copyfile(src, tmp)
+            os.replace(tmp, file)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        return _response(200, headers)
+
+
+def get_backend(paths):
+    """
+    Returns the storage backend selected by paths: paths.backend if set,
+    otherwise chosen from paths.remote_path, which may be
+    an https URL of the public data commons (default) or of a public
+    mirror of it on another S3-compatible server,
+    's3://bucket' for an S3-compatible store, whose endpoint is read from
+    the AWS_ENDPOINT_URL environment variable, or
+    a local directory or 'file://' URL for a filesystem mirror.
+    :param paths: instance of class Paths
+    :return: backend instance
+    """
+    backend = getattr(paths, 'backend', None)
+    if backend is not None:
+        return backend
+    remote = str(paths.remote_path)
+    url = urlparse(remote)
+    if url.scheme == 's3':
+        # read explicitly, boto3 only honours it from version 1.28
+        return S3Backend(url.netloc,
+                         endpoint_url=os.environ.get('AWS_ENDPOINT_URL'))
+    if url.scheme == 'file':
+        return FilesystemBackend(url2pathname(url.path))
+    if url.scheme in ('http', 'https'):
+        bucket = None
+        if url.netloc.endswith('.s3.amazonaws.com'):
+            bucket = url.netloc[:-len('.s3.amazonaws.com')]
+        return DataCommonsBackend(public_url=remote, bucket=bucket)
+    return FilesystemBackend(remote)
+
+
+def _listing(rows):
+    return pd.DataFrame(rows, columns=['file_name', 'date', 'size'])
+
+
+def _response(status_code, headers):
+    """Builds a body-less requests.Response carrying headers"""
+    r = requests.Response()
+    r.status_code = status_code
+    r.headers.update({k: v for k, v in headers.items() if v is not None})
+    return r
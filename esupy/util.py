@@ -5,12 +5,17 @@
 Simple utility functions for reuse in tools
 """
 import inspect
+import json
+import logging as log
 import os
 from pathlib import Path
+import socket
 import subprocess
+import threading
+import time
 import uuid
 
-supported_ext = ["parquet", "csv"]
+supported_ext = ["parquet", "csv", "arrow"]
 
 
 def strip_file_extension(filename):
@@ -75,3 +80,137 @@ def make_uuid(*args: str) -> str:
     """
     path = as_path(*args)
     return str(uuid.uuid3(uuid.NAMESPACE_OID, path))
+
+
+class FileLock:
+    """
+    Cross-process lock on a local file, held by exclusively creating
+    .locks/{name}.lock in its folder, so that one process downloads or
+    writes the file while others wait and then reuse it. The holder touches
+    the lock file every few seconds; a lock not touched for stale_after
+    seconds, or held by a process on this host that no longer exists, was
+    left by a crashed process and is cleared.
+
+    >>> with FileLock(path) as lock:  # doctest: +SKIP
+    ...     if not (lock.waited and path.exists()):
+    ...         write(path)
+    """
+    def __init__(self, path, timeout=3600, stale_after=60, poll=0.2):
+        """
+        :param path: pathlib.Path, file to lock
+        :param timeout: float, seconds to wait before raising TimeoutError
+        :param stale_after: float, seconds without heartbeat before a lock
+            is considered abandoned
+        :param poll: float, seconds between attempts
+        """
+        self.path = Path(path)
+        # kept in a subfolder so locking does not change the folder mtime
+        # that local catalogs are validated against
+        self.lock_path = (self.path.parent / '.locks' /
+                          f'{self.path.name}.lock')
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self.poll = poll
+        self.waited = False
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def acquire(self):
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        deadline = time.time() + self.timeout
+        owner = json.dumps({'pid': os.getpid(), 'host': socket.gethostname(),
+                            'time': time.time()})
+        while True:
+            try:
+                fd = os.open(self.lock_path,
+                             os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                self.waited = True
+                self._clear_if_stale()
+                if time.time() > deadline:
+                    raise TimeoutError(f'Timed out waiting for lock on '
+                                       f'{self.path}')
+                time.sleep(self.poll)
+                continue
+            with os.fdopen(fd, 'w') as fi:
+                fi.write(owner)
+            break
+        self._stop.clear()
+        self._heartbeat = threading.Thread(target=self._beat, daemon=True)
+        self._heartbeat.start()
+        return self
+
+    def release(self):
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+        try:
+            self.lock_path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def _beat(self):
+        while not self._stop.wait(self.stale_after / 4):
+            try:
+                os.utime(self.lock_path)
+            except FileNotFoundError:
+                # briefly moved aside by a waiter in _clear_if_stale(),
+                # keep beating until release() stops the thread
+                continue
+
+    def _clear_if_stale(self):
+        try:
+            content = self.lock_path.read_text()
+            age = time.time() - self.lock_path.stat().st_mtime
+        except FileNotFoundError:
+            return
+        try:
+            owner = json.loads(content)
+        except ValueError:
+            # lock file just created, owner not yet written
+            owner = {}
+        dead = (owner.get('host') == socket.gethostname() and
+                not _pid_alive(owner.get('pid')))
+        if age < self.stale_after and not dead:
+            return
+        # move the lock aside before deleting, so that only one waiter
+        # clears it, then check it was not replaced by a live lock meanwhile
+        aside = self.lock_path.with_name(
+            f'{self.lock_path.name}.{os.getpid()}.{threading.get_ident()}')
+        try:
+            os.replace(self.lock_path, aside)
+        except FileNotFoundError:
+            return
+        if aside.read_text() == content:
+            log.warning(f'Cleared stale lock on {self.path}')
+            aside.unlink()
+            return
+        # moved a live lock taken after the check, put it back without
+        # replacing one another waiter may have created since
+        try:
+            os.link(aside, self.lock_path)
+        except OSError:
+            log.error(f'Lost a live lock on {self.path}, kept as {aside}')
+            return
+        aside.unlink()
+
+
+def _pid_alive(pid):
+    """True if a process with pid exists on this host; assumed on Windows"""
+    if not isinstance(pid, int) or os.name == 'nt':
+        # os.kill(pid, 0) would send CTRL_C_EVENT on Windows
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -1,12 +1,33 @@
 """Test functions"""
 
+import asyncio
+import functools
+import http.server
+import json
+import os
 import pytest
+import socket
 import sys
+import threading
+import time
+import zipfile
 from pathlib import Path
+from urllib.parse import parse_qs, urlparse
 
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import requests
+
+import esupy.context_secondary as cs
 import esupy.processed_data_mgmt as es_dt
+import esupy.remote as remote
+import esupy.util as es_util
 import esupy.bibtex as bibtex
 import esupy.location as loc
+from esupy.http_cache import ResponseCache
+from esupy.mapping import apply_flow_mapping
+from esupy.storage import DataCommonsBackend, S3Backend, get_backend
 
 
 def test_data_commons_access():
@@ -39,3 +60,677 @@ def test_source_generation():
 
 def test_locations():
     d = loc.extract_coordinates(group='states')
+
+
+def _fake_index(file_names):
+    return pd.DataFrame({'date': pd.Timestamp('2024-01-01'),
+                         'file_name': file_names})
+
+
+@pytest.fixture
+def remote_store(tmp_path, monkeypatch):
+    """Serves tmp_path/remote over http and points a Paths instance at it"""
+    root = tmp_path / 'remote'
+    folder = root / 'flowsa' / 'FlowByActivity'
+    folder.mkdir(parents=True)
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler,
+                                directory=str(root))
+    handler.log_message = lambda *args: None
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    path = es_dt.Paths()
+    path.local_path = tmp_path / 'local'
+    path.remote_path = f'http://127.0.0.1:{server.server_port}/'
+    monkeypatch.setattr(es_dt, 'get_data_commons_index',
+                        lambda file_meta, paths: _fake_index(
+                            sorted(f.name for f in folder.iterdir())))
+    yield path, folder
+    server.shutdown()
+
+
+def _flowsa_meta(name_data, ext='parquet'):
+    meta = es_dt.FileMeta()
+    meta.tool = 'flowsa'
+    meta.category = 'FlowByActivity'
+    meta.name_data = name_data
+    meta.ext = ext
+    return meta
+
+
+def test_download_from_remote(remote_store):
+    path, folder = remote_store
+    df = pd.DataFrame({'Flowable': ['a', 'b'], 'FlowAmount': [1.0, 2.0]})
+    df.to_parquet(folder / 'X_v1.0.0_abcdef1.parquet')
+    (folder / 'X_v1.0.0_abcdef1_metadata.json').write_text('{}')
+    (folder / 'X_v0.9.0_1234567.parquet').write_bytes(b'old')
+    df.to_parquet(folder / 'Y_v1.0.0_abcdef1.parquet')
+    meta = _flowsa_meta('X')
+    assert es_dt.download_from_remote(meta, path)
+    assert sorted(f.name for f in (path.local_path / 'FlowByActivity').iterdir()
+                  if not f.name.startswith('.')) == [
+        'X_v1.0.0_abcdef1.parquet', 'X_v1.0.0_abcdef1_metadata.json']
+    assert es_dt.load_preprocessed_output(meta, path).equals(df)
+    out = es_dt.load_preprocessed_outputs(
+        [meta, _flowsa_meta('Y'), _flowsa_meta('NOT_A_FILE')], path)
+    assert out['X'].equals(df) and out['NOT_A_FILE'] is None
+    other = _flowsa_meta('X')
+    other.category = 'FlowBySector'
+    with pytest.raises(ValueError):
+        es_dt.prefetch_preprocessed_outputs([meta, other], path)
+    assert es_dt.download_files(['missing.csv'], meta, path) == {
+        'missing.csv': 'failed'}
+    assert set(es_dt.ensure_up_to_date(meta, path).values()) == {'unchanged'}
+    (path.local_path / 'FlowByActivity' / 'X_v1.0.0_abcdef1.parquet').unlink()
+    assert es_dt.ensure_up_to_date(meta, path) == {
+        'X_v1.0.0_abcdef1.parquet': 'downloaded',
+        'X_v1.0.0_abcdef1_metadata.json': 'unchanged'}
+    # a newly published version is found despite the cached index
+    df.to_parquet(folder / 'X_v1.1.0_abcdef1.parquet')
+    assert es_dt.ensure_up_to_date(meta, path) == {
+        'X_v1.1.0_abcdef1.parquet': 'downloaded'}
+
+
+def test_sync_from_remote(remote_store):
+    path, folder = remote_store
+    for f in ['X_v1.0.0_abcdef1.parquet', 'X_v1.1.0_abcdef1.parquet',
+              'X_v1.1.0_abcdef1_metadata.json', 'Y_v2.0.0_1234567.csv']:
+        (folder / f).write_bytes(b'0' * 10)
+    meta = _flowsa_meta('')
+    summary = es_dt.sync_from_remote(meta, path, latest_only=True)
+    assert summary['downloaded'] == 3 and summary['bytes'] == 30
+    summary = es_dt.sync_from_remote(meta, path)
+    assert summary['downloaded'] == 1 and summary['unchanged'] == 3
+
+
+def test_filesystem_backend(tmp_path):
+    folder = tmp_path / 'mirror' / 'flowsa' / 'FlowByActivity'
+    folder.mkdir(parents=True)
+    for f in ['X_v1.0.0_abcdef1.csv', 'X_v1.1.0_abcdef1.csv']:
+        (folder / f).write_text('Flowable,FlowAmount\na,1.0\n')
+    path = es_dt.Paths()
+    path.local_path = tmp_path / 'local'
+    path.remote_path = (tmp_path / 'mirror').as_uri()
+    meta = _flowsa_meta('X', ext='csv')
+    assert es_dt.get_most_recent_from_index(meta, path) == [
+        'X_v1.1.0_abcdef1.csv']
+    assert es_dt.download_from_remote(meta, path)
+    assert len(es_dt.load_preprocessed_output(meta, path)) == 1
+    assert es_dt.ensure_up_to_date(meta, path) == {
+        'X_v1.1.0_abcdef1.csv': 'unchanged'}
+    # sub-second mtimes of the mirror do not make unchanged files look newer
+    assert es_dt.sync_from_remote(meta, path)['downloaded'] == 1
+    summary = es_dt.sync_from_remote(meta, path)
+    assert summary['downloaded'] == 0 and summary['unchanged'] == 2
+
+
+def test_data_commons_index_cache(tmp_path, monkeypatch):
+    path = es_dt.Paths()
+    path.local_path = tmp_path
+    meta = es_dt.FileMeta()
+    meta.tool = 'flowsa'
+    meta.category = 'FlowByActivity'
+    calls = []
+
+    def fake_index(file_meta, paths):
+        calls.append(1)
+        return _fake_index(['X_v1.0.0_abcdef1.parquet'])
+    monkeypatch.setattr(es_dt, 'get_data_commons_index', fake_index)
+
+    assert not es_dt.index_is_fresh(meta, path)
+    df1 = es_dt.load_data_commons_index(meta, path)
+    df2 = es_dt.load_data_commons_index(meta, path)
+    assert es_dt.index_is_fresh(meta, path)
+    assert len(calls) == 1 and df1.equals(df2)
+    es_dt.load_data_commons_index(meta, path, force_refresh=True)
+    es_dt.load_data_commons_index(meta, path, ttl=0)
+    assert len(calls) == 3
+    # the index listed from one remote is not reused for another
+    path.remote_path = tmp_path / 'mirror'
+    assert not es_dt.index_is_fresh(meta, path)
+    es_dt.load_data_commons_index(meta, path)
+    assert len(calls) == 4
+    meta.name_data = 'missing'
+    meta.ext = 'parquet'
+    assert not es_dt.download_from_remote(meta, path)
+
+
+def test_storage_backends(tmp_path, monkeypatch):
+    path = es_dt.Paths()
+    monkeypatch.setenv('AWS_ENDPOINT_URL', 'http://minio.local:9000')
+    path.remote_path = 's3://bucket'
+    backend = get_backend(path)
+    assert backend.endpoint_url == 'http://minio.local:9000'
+    assert backend.client() is backend.client()
+    assert isinstance(backend, S3Backend)
+
+    pages = {None: ('<Contents><Key>flowsa/a.parquet</Key><LastModified>'
+                    '2024-01-01T00:00:00.000Z</LastModified><Size>1</Size>'
+                    '</Contents><IsTruncated>true</IsTruncated>'
+                    '<NextContinuationToken>t1</NextContinuationToken>'),
+             't1': ('<Contents><Key>flowsa/b.parquet</Key><LastModified>'
+                    '2024-01-02T00:00:00.000Z</LastModified><Size>2</Size>'
+                    '</Contents><IsTruncated>false</IsTruncated>')}
+
+    class ListHandler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            body = ('<ListBucketResult xmlns="http://s3.amazonaws.com/doc/'
+                    '2006-03-01/">' + pages[query.get(
+                        'continuation-token', [None])[0]]
+                    + '</ListBucketResult>').encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), ListHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    path.remote_path = f'http://127.0.0.1:{server.server_port}/bucket/'
+    backend = get_backend(path)
+    assert isinstance(backend, DataCommonsBackend) and backend.bucket is None
+    df = backend.list_objects('flowsa/')
+    server.shutdown()
+    assert list(df['file_name']) == ['flowsa/a.parquet', 'flowsa/b.parquet']
+    assert list(df['size']) == [1, 2]
+
+
+def test_download_segmented(tmp_path):
+    body = os.urandom(100_000)
+
+    class RangeHandler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_HEAD(self):
+            if self.path == '/nohead.bin':
+                self.send_response(405)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', '"v1"')
+            self.end_headers()
+
+        def do_GET(self):
+            start, end = 0, len(body) - 1
+            if 'Range' in self.headers:
+                start, end = map(int, self.headers['Range'][6:].split('-'))
+                self.send_response(206)
+            else:
+                self.send_response(200)
+            self.send_header('Content-Length', str(end - start + 1))
+            self.end_headers()
+            self.wfile.write(body[start:end + 1])
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/f.bin'
+    target = tmp_path / 'f.bin'
+    # simulate an interrupted earlier attempt holding part of range 0
+    part_dir = remote._segment_dir(target, {
+        'url': url, 'size': len(body), 'validator': '"v1"',
+        'ranges': [[0, 24999], [25000, 49999],
+                   [50000, 74999], [75000, 99999]]})
+    (part_dir / '0').write_bytes(body[:1000])
+    remote.download_segmented(url, target, segments=4,
+                              min_segment_size=10_000)
+    assert target.read_bytes() == body
+    assert not part_dir.exists()
+    remote.download_segmented(url, tmp_path / 'g.bin', segments=4)
+    assert (tmp_path / 'g.bin').read_bytes() == body
+    # a server refusing HEAD is downloaded with a single GET
+    url = f'http://127.0.0.1:{server.server_port}/nohead.bin'
+    remote.download_segmented(url, tmp_path / 'h.bin', segments=4)
+    assert (tmp_path / 'h.bin').read_bytes() == body
+    cache = remote.ResponseCache(tmp_path / 'cache')
+    assert remote.cached_file(url, cache=cache).read_bytes() == body
+    server.shutdown()
+
+
+def test_download_file_verification(tmp_path):
+    class BadHandler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self.send_response(200)
+            if self.path == '/short':
+                # promises more bytes than sent before closing
+                self.send_header('Content-Length', '10')
+                self.end_headers()
+                self.wfile.write(b'12345')
+                self.close_connection = True
+                return
+            self.send_header('Content-Length', '5')
+            self.send_header('ETag', '"' + '0' * 32 + '"')
+            self.end_headers()
+            self.wfile.write(b'12345')
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), BadHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    target = tmp_path / 'f.bin'
+    with pytest.raises(IOError):
+        remote.download_file(f'{base}/short', target, max_attempts=1)
+    with pytest.raises(IOError, match='checksum'):
+        remote.download_file(f'{base}/etag', target, verify_checksum=True)
+    server.shutdown()
+    # neither a partial file at the target nor a temp file is left
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_http_client_retries():
+    calls = []
+
+    class FlakyHandler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            calls.append(self.headers.get('User-Agent'))
+            if self.path == '/busy' and len(calls) == 1:
+                self.send_response(503)
+                self.send_header('Retry-After', '0')
+            elif self.path == '/forbidden' and len(calls) == 1:
+                self.send_response(403)
+            else:
+                self.send_response(200)
+                self.send_header('Set-Cookie', 'id=1; Path=/')
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'ok')
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FlakyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    client = remote.HttpClient(backoff=0.01)
+    assert client.request('GET', f'{base}/busy').content == b'ok'
+    assert client.stats()['requests'] == 2
+    assert client.stats()['retries'] == 1 and client.stats()['bytes'] == 4
+    calls.clear()
+    assert remote.make_url_request(f'{base}/forbidden').content == b'ok'
+    assert calls[1] == remote.headers['User-Agent']
+    # the shared session keeps no cookies, and a request with its own
+    # cookies leaves the shared connection pools open
+    assert remote.make_url_request(f'{base}/a', set_cookies=True).ok
+    assert not client.session.cookies and not remote.client.session.cookies
+    assert remote.client.session.get_adapter(base).poolmanager.pools
+    # a streamed response holds its host slot until it is closed
+    client = remote.HttpClient(max_per_host=1)
+    first = client.request('GET', f'{base}/a', stream=True)
+    second = threading.Thread(target=client.request, args=('GET', f'{base}/b'))
+    second.start()
+    second.join(0.3)
+    assert second.is_alive()
+    first.close()
+    second.join(5)
+    assert not second.is_alive()
+    server.shutdown()
+
+
+def test_fetch_many(remote_store):
+    path, folder = remote_store
+    for i in range(5):
+        (folder / f'{i}.txt').write_text(str(i))
+    base = f'{path.remote_path}flowsa/FlowByActivity/'
+    urls = [f'{base}{i}.txt' for i in range(5)] + [f'{base}missing.txt']
+    out = remote.fetch_many(urls, max_concurrency=3)
+    assert [r.text for r in out[:5]] == ['0', '1', '2', '3', '4']
+    assert isinstance(out[5], requests.exceptions.HTTPError)
+
+    async def from_running_loop():
+        return remote.fetch_many(urls[:2])
+    assert [r.text for r in asyncio.run(from_running_loop())] == ['0', '1']
+
+
+def test_response_cache(remote_store, tmp_path):
+    path, folder = remote_store
+    for name in ['a.txt', 'b.txt']:
+        (folder / name).write_text(name * 100)
+    base = f'{path.remote_path}flowsa/FlowByActivity/'
+    cache = ResponseCache(tmp_path / 'cache', max_bytes=800)
+    remote.client.reset_stats()
+    assert remote.make_url_request(f'{base}a.txt', cache=cache).text == (
+        'a.txt' * 100)
+    assert remote.make_url_request(f'{base}a.txt', cache=cache).text == (
+        'a.txt' * 100)
+    assert remote.client.stats()['requests'] == 1
+    # stale entries are revalidated, the unchanged body is not sent again
+    remote.make_url_request(f'{base}a.txt', cache=cache, max_age=0)
+    assert remote.client.stats()['requests'] == 2
+    assert remote.cached_file(f'{base}b.txt', cache=cache).read_text() == (
+        'b.txt' * 100)
+    # both bodies do not fit in max_bytes, the least recently used goes
+    assert cache.entry(f'{base}a.txt') is None
+    assert cache.size() == 500
+    cache.offline = True
+    assert remote.make_url_request(f'{base}b.txt', cache=cache,
+                                   max_age=0).status_code == 200
+    with pytest.raises(requests.exceptions.ConnectionError):
+        remote.make_url_request(f'{base}a.txt', cache=cache)
+    # cached_file() sends a HEAD before the GET
+    assert remote.client.stats()['requests'] == 4
+
+
+def test_check_urls(remote_store):
+    path, folder = remote_store
+    (folder / 'a.txt').write_text('a' * 100)
+    base = f'{path.remote_path}flowsa/FlowByActivity/'
+    df = remote.check_urls([f'{base}a.txt', f'{base}missing.txt',
+                            'http://127.0.0.1:9/'], timeout=5)
+    assert df['ok'].tolist() == [True, False, False]
+    assert df['status'].tolist()[:2] == [200, 404]
+    assert df['content_length'][0] == 100
+    assert df['method'].tolist()[:2] == ['HEAD', 'GET']
+    assert df['error'][2] is not None
+    assert remote.url_is_alive(f'{base}a.txt')
+
+
+def test_census_shp_cache(remote_store, tmp_path, monkeypatch):
+    gpd = pytest.importorskip('geopandas')
+    import shapely
+    path, folder = remote_store
+    for name, x in [('us', 0), ('78', 10)]:
+        gdf = gpd.GeoDataFrame({'NAME': [name]}, crs='EPSG:4269',
+                               geometry=[shapely.box(x, 0, x + 1, 1)])
+        gdf.to_file(tmp_path / f'tl_{name}.shp')
+        with zipfile.ZipFile(folder / f'tl_{name}.zip', 'w') as z:
+            for f in tmp_path.glob(f'tl_{name}.*'):
+                z.write(f, f.name)
+    base = f'{path.remote_path}flowsa/FlowByActivity/'
+    urls = tmp_path / 'urls.yaml'
+    urls.write_text(f'2010:\n  - {base}tl_us.zip\n  - {base}tl_78.zip\n'
+                    f'2011:\n  - {base}tl_us.zip\n  - {base}tl_78.zip\n')
+    monkeypatch.setattr(remote, 'http_cache',
+                        ResponseCache(tmp_path / 'http_cache'))
+    remote.client.reset_stats()
+    gdf = cs.get_census_shp(2010, urls=urls, paths=path)
+    assert len(gdf) == 2 and gdf.crs == 'EPSG:4326'
+    assert cs.get_census_shp(2011, urls=urls, paths=path)[
+        'NAME'].tolist() == ['us', '78']
+    assert remote.client.stats()['requests'] == 4
+    assert len(list((path.local_path / 'census_uac').glob('*.parquet'))) == 1
+
+
+def test_find_file_catalog(tmp_path):
+    path = es_dt.Paths()
+    path.local_path = tmp_path
+    meta = _flowsa_meta('X')
+    meta.git_hash = 'abcdef1'
+    df = pd.DataFrame({'a': [1]})
+    for v in ['1.10.0', '1.9.0']:
+        meta.tool_version = v
+        es_dt.write_df_to_file(df, path, meta)
+    assert es_dt.find_file(meta, path).name == 'X_v1.10.0_abcdef1.parquet'
+    # files added outside esupy are picked up once the folder changes
+    (tmp_path / 'FlowByActivity' / 'X_v2.0.0_abcdef1.parquet').write_bytes(
+        b'')
+    assert es_dt.find_file(meta, path).name == 'X_v2.0.0_abcdef1.parquet'
+    meta.name_data = 'X_v1.9'
+    assert es_dt.find_file(meta, path).name == 'X_v1.9.0_abcdef1.parquet'
+    # a file another process adds while this one writes is kept
+    folder = tmp_path / 'FlowByActivity'
+    catalog = es_dt.load_catalog(folder, path)
+    before = catalog['mtime_ns']
+    (folder / 'Y_v1.0.0_abcdef1.parquet').write_bytes(b'')
+    (folder / 'X_v3.0.0_abcdef1.parquet').write_bytes(b'')
+    es_dt.update_catalog(path, [folder / 'X_v3.0.0_abcdef1.parquet'], before)
+    es_dt._catalogs.clear()
+    assert es_dt.find_file(_flowsa_meta('Y'), path) is not None
+    assert es_dt.parse_file_name('X_Y_v1.0.2_abcdef1_metadata.json') == {
+        'name': 'X_Y', 'version': '1.0.2', 'git_hash': 'abcdef1',
+        'suffix': 'metadata', 'ext': 'json'}
+
+
+@pytest.mark.parametrize('ext', ['parquet', 'csv'])
+def test_load_columns_filters(tmp_path, ext):
+    path = es_dt.Paths()
+    path.local_path = tmp_path
+    meta = _flowsa_meta('X', ext=ext)
+    meta.tool_version = '1.0.0'
+    df = pd.DataFrame({'Location': ['00000', '01000', '02000'],
+                       'Year': [2016, 2017, 2017],
+                       'FlowAmount': [1.0, 2.0, 3.0]})
+    es_dt.write_df_to_file(df, path, meta)
+    out = es_dt.load_preprocessed_output(
+        meta, path, columns=['FlowAmount'],
+        filters=[('Year', '=', 2017), ('FlowAmount', '>', 2)])
+    assert list(out.columns) == ['FlowAmount']
+    assert out['FlowAmount'].tolist() == [3.0]
+
+
+def test_df_cache(tmp_path):
+    path = es_dt.Paths()
+    path.local_path = tmp_path
+    meta = _flowsa_meta('X')
+    meta.tool_version = '1.0.0'
+    es_dt.write_df_to_file(pd.DataFrame({'a': [1, 2]}), path, meta)
+    cache = es_dt.enable_df_cache()
+    try:
+        df1 = es_dt.load_preprocessed_output(meta, path)
+        df1.loc[0, 'a'] = 100
+        df2 = es_dt.load_preprocessed_output(meta, path)
+        assert df2['a'].tolist() == [1, 2]
+        assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+        es_dt.write_df_to_file(pd.DataFrame({'a': [3]}), path, meta)
+        assert cache.stats()['entries'] == 0
+        assert es_dt.load_preprocessed_output(meta, path)['a'].tolist() == [3]
+    finally:
+        es_dt.enable_df_cache(0)
+        cache.clear()
+
+
+def test_most_recent_from_index(monkeypatch):
+    path = es_dt.Paths()
+    meta = _flowsa_meta('X')
+    files = ['X_v1.9.0_1234567.parquet', 'X_v1.9.0_1234567_metadata.json',
+             'X_v1.10.0_abcdef1.parquet', 'X_v1.10.0_abcdef1_metadata.json',
+             'X_v1.10.0_abcdef1_log.txt', 'X_v1.10.1_abcdef1.csv',
+             'readme']
+    df = es_dt.parse_data_commons_index(_fake_index(files))
+    assert df.loc[6, 'name'] == 'readme' and df.loc[6, 'ext'] == ''
+    monkeypatch.setattr(es_dt, 'load_data_commons_index',
+                        lambda file_meta, paths: df)
+    assert es_dt.get_most_recent_from_index(meta, path) == files[2:5]
+
+
+def test_partitioned_parquet(tmp_path):
+    path = es_dt.Paths()
+    path.local_path = tmp_path
+    meta = _flowsa_meta('X')
+    meta.tool_version = '1.0.0'
+    df = pd.DataFrame({'Location': ['00000', '01000', '01000'],
+                       'Year': [2016, 2017, 2017],
+                       'FlowAmount': [1.0, 2.0, 3.0]})
+    es_dt.write_df_to_file(df, path, meta, partition_cols=['Year', 'Location'],
+                           compression='zstd', row_group_size=2)
+    out = es_dt.load_preprocessed_output(meta, path)
+    out = out.sort_values('FlowAmount').reset_index(drop=True)
+    assert out.equals(df)
+    out = es_dt.load_preprocessed_output(meta, path,
+                                         filters=[('Location', '=', '01000')])
+    assert sorted(out['FlowAmount']) == [2.0, 3.0]
+
+
+def test_arrow_format(tmp_path):
+    path = es_dt.Paths()
+    path.local_path = tmp_path
+    meta = _flowsa_meta('X')
+    meta.tool_version = '1.0.0'
+    df = pd.DataFrame({'Location': ['00000', '01000'], 'FlowAmount': [1., 2.]})
+    es_dt.write_df_to_file(df, path, meta)
+    assert [f.name for f in es_dt.convert_to_arrow(path)] == [
+        'X_v1.0.0_.arrow']
+    meta.ext = 'arrow'
+    assert es_dt.load_preprocessed_output(meta, path).equals(df)
+    out = es_dt.load_preprocessed_output(meta, path, columns=['FlowAmount'],
+                                         filters=[('Location', '=', '01000')])
+    assert out['FlowAmount'].tolist() == [2.0]
+
+
+def test_compact_mapping(tmp_path):
+    df = pd.DataFrame({'SourceName': ['S'] * 4,
+                       'Flowable': ['a', 'a', 'b', None],
+                       'Context': ['air'] * 4,
+                       'Unit': ['kg'] * 4,
+                       'FlowAmount': [1.0, 2.0, 3.0, 4.0],
+                       'FlowUUID': [''] * 4})
+    df = es_dt.compact_df(df)
+    assert isinstance(df['Unit'].dtype, pd.CategoricalDtype)
+    pd.DataFrame({'SourceListName': ['S'], 'SourceFlowName': ['a'],
+                  'SourceFlowContext': ['air'], 'SourceUnit': ['kg'],
+                  'ConversionFactor': [1000], 'TargetFlowName': ['A'],
+                  'TargetFlowContext': ['emission/air'], 'TargetUnit': ['g'],
+                  'TargetFlowUUID': ['u']}
+                 ).to_csv(tmp_path / 'map.csv', index=False)
+    mapped = apply_flow_mapping(df, 'S', 'TECHNOSPHERE_FLOW',
+                                keep_unmapped_rows=True,
+                                material_crosswalk=tmp_path / 'map.csv')
+    assert mapped['Flowable'].tolist() == ['A', 'A', 'b', '']
+    assert mapped['FlowAmount'].tolist() == [1000.0, 2000.0, 3.0, 4.0]
+
+
+@pytest.mark.parametrize('ext', ['parquet', 'csv', 'arrow'])
+def test_iter_preprocessed_output(tmp_path, ext):
+    path = es_dt.Paths()
+    path.local_path = tmp_path
+    meta = _flowsa_meta('X', ext=ext)
+    meta.tool_version = '1.0.0'
+    df = pd.DataFrame({'Year': [2016, 2017] * 5, 'FlowAmount': range(10)})
+    es_dt.write_df_to_file(df, path, meta)
+    chunks = list(es_dt.iter_preprocessed_output(
+        meta, path, chunksize=4, columns=['FlowAmount'],
+        filters=[('Year', '=', 2017)]))
+    assert all(len(c) <= 4 for c in chunks)
+    assert pd.concat(chunks)['FlowAmount'].tolist() == [1, 3, 5, 7, 9]
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+def test_csv_schema(tmp_path, compression):
+    path = es_dt.Paths()
+    path.local_path = tmp_path
+    meta = _flowsa_meta('X', ext='csv')
+    meta.tool_version = '1.0.0'
+    meta.git_hash = 'abcdef1'
+    df = pd.DataFrame({'Location': ['00000', '01000'], 'Year': [2017, 2017],
+                       'FlowAmount': [1.5, 2.0]})
+    es_dt.write_df_to_file(df, path, meta, compression=compression)
+    es_dt.write_metadata_to_file(path, meta)
+    out = es_dt.load_preprocessed_output(meta, path)
+    assert out['Location'].tolist() == ['00000', '01000']
+    assert out['Year'].dtype == 'int64'
+    assert es_dt.read_source_metadata(path, meta)['schema'] is not None
+    # compact mode records Location as category, still read as strings
+    es_dt.write_df_to_file(pd.concat([df, df]), path, meta,
+                           compression=compression, compact=True)
+    es_dt.write_metadata_to_file(path, meta)
+    out = es_dt.load_preprocessed_output(meta, path)
+    assert out['Location'].dtype == 'category'
+    assert out['Location'].tolist() == ['00000', '01000'] * 2
+    chunks = es_dt.iter_preprocessed_output(meta, path)
+    assert pd.concat(chunks)['Location'].astype(str).tolist() == [
+        '00000', '01000'] * 2
+
+
+def test_rds_sidecar(tmp_path):
+    f = tmp_path / 'x.rds'
+    f.write_bytes(b'not read while the transcode is current')
+    table = pa.Table.from_pandas(pd.DataFrame({'a': [1, 2]}))
+    pq.write_table(table.replace_schema_metadata(
+        {**table.schema.metadata,
+         es_dt.RDS_SOURCE_KEY: es_dt._rds_source_key(f)}),
+        es_dt.rds_sidecar_path(f))
+    assert es_dt.read_into_df(f, filters=[('a', '=', 2)])['a'].tolist() == [2]
+
+
+def test_collect_garbage(tmp_path):
+    path = es_dt.Paths()
+    path.local_path = tmp_path
+    folder = tmp_path / 'FlowByActivity'
+    folder.mkdir()
+    for i, v in enumerate(['1.0.0', '1.1.0', '2.0.0']):
+        for f in [f'X_v{v}_abcdef1.parquet', f'X_v{v}_abcdef1_metadata.json']:
+            (folder / f).write_bytes(b'0' * 100)
+            os.utime(folder / f, (1000 * (3 - i), 1000 * (3 - i)))
+    (folder / 'notes.txt').write_bytes(b'0' * 1000)
+    # versioned names that are not esupy data
+    (folder / 'libfoo_v2.so').write_bytes(b'0' * 1000)
+    (folder / 'someapp_v2.0').mkdir()
+    (folder / 'someapp_v2.0' / 'X_v1.0.parquet').write_bytes(b'0' * 1000)
+    # folders esupy never used are left alone
+    other = tmp_path / 'otherapp'
+    other.mkdir()
+    (other / 'X_v0.1.0_abcdef1.parquet').write_bytes(b'0' * 1000)
+    assert es_dt.collect_garbage(path, quota_bytes=0).empty
+    es_dt.load_catalog(folder, path)
+    assert es_dt.managed_folders(path) == [folder]
+    report = es_dt.collect_garbage(path, quota_bytes=400, dry_run=True)
+    assert report['action'].tolist() == ['keep latest', 'evict', 'keep']
+    assert report.loc[1, 'version'] == '1.1.0'
+    assert len(list(folder.iterdir())) == 9
+    # versions in use by another process are skipped
+    with es_util.FileLock(folder / 'X_v1.0.0_abcdef1.parquet'):
+        report = es_dt.collect_garbage(path, quota_bytes=0)
+    assert sorted(report['action']) == ['evict', 'keep latest', 'locked']
+    es_dt.collect_garbage(path, quota_bytes=0)
+    assert sorted(f.name for f in folder.iterdir()
+                  if not f.name.startswith('.')) == [
+        'X_v2.0.0_abcdef1.parquet', 'X_v2.0.0_abcdef1_metadata.json',
+        'libfoo_v2.so', 'notes.txt', 'someapp_v2.0']
+    assert (other / 'X_v0.1.0_abcdef1.parquet').exists()
+
+
+def test_file_lock(tmp_path, monkeypatch):
+    target = tmp_path / 'f.parquet'
+    order = []
+    lock = es_util.FileLock(target).acquire()
+    other = es_util.FileLock(target, poll=0.01)
+
+    def wait():
+        with other:
+            order.append('waiter')
+    t = threading.Thread(target=wait)
+    t.start()
+    while not other.waited:
+        time.sleep(0.01)
+    order.append('holder')
+    lock.release()
+    t.join()
+    assert order == ['holder', 'waiter']
+    # lock left by a crashed process on this host is cleared
+    lock.lock_path.write_text(json.dumps(
+        {'pid': 2 ** 22 + 1, 'host': socket.gethostname()}))
+    with es_util.FileLock(target, timeout=5, poll=0.01) as new:
+        assert new.waited
+    assert not lock.lock_path.exists()
+    # a live lock that replaced the stale one while it was judged is kept
+    stale = json.dumps({'pid': 2 ** 22 + 1,
+                        'host': socket.gethostname()})
+    lock.lock_path.write_text(stale)
+    real_replace = es_util.os.replace
+
+    def replace_then_relock(src, dst):
+        real_replace(src, dst)
+        if src == lock.lock_path:
+            Path(dst).write_text('{"pid": 1}')
+    monkeypatch.setattr(es_util.os, 'replace', replace_then_relock)
+    lock._clear_if_stale()
+    monkeypatch.undo()
+    assert lock.lock_path.read_text() == '{"pid": 1}'
+    lock.lock_path.unlink()
+    # the holder keeps beating after its lock was briefly moved aside
+    held = es_util.FileLock(target, stale_after=0.2).acquire()
+    aside = held.lock_path.with_name('aside')
+    os.replace(held.lock_path, aside)
+    time.sleep(0.1)
+    os.replace(aside, held.lock_path)
+    before = held.lock_path.stat().st_mtime
+    time.sleep(0.2)
+    assert held._heartbeat.is_alive()
+    assert held.lock_path.stat().st_mtime > before
+    held.release()